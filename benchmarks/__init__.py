@@ -0,0 +1 @@
+'''Benchmarks, run from repo root as python -m benchmarks.<name>'''
@@ -0,0 +1,107 @@
+'''
+Alert extraction from TradingView mails, legacy string replaces vs bytes extractor
+
+python -m benchmarks.alert_extraction [directory with real .eml files]
+also checks that every quoted-printable wrap offset of markers is parsed
+'''
+
+import os
+import sys
+import time
+import email
+from src.modules.mail_handler import (
+    StrategyAlert,
+    get_mail_subject,
+    extract_raw_alert_json,
+    get_strategy_alert_mail_content
+)
+from .payloads import tradingview_mail
+
+
+def legacy_extract(raw_message: bytes) -> StrategyAlert:
+    '''Previous implementation on first text part of parsed message'''
+    message = email.message_from_bytes(raw_message)
+    mail_content = next(
+        part for part in message.walk() if part.get_content_maintype() == 'text'
+    ).get_payload()
+    mail_content = mail_content.replace(
+        "\r", ''
+    ).replace(
+        "\n", ''
+    ).replace(
+        '=', ''
+    )
+    encoded_json_string = mail_content[
+        (mail_content.find('MESSAGE_START') +
+            len('MESSAGE_START')):mail_content.find('MESSAGE_END')
+    ]
+    encoded_json_string = encoded_json_string.replace('&#34;', '"')
+    return StrategyAlert.parse_raw(encoded_json_string)
+
+def current_extract(raw_message: bytes) -> StrategyAlert:
+    '''Subject routing and bytes extractor as used by mail dispatcher'''
+    get_mail_subject(raw_message)
+    return get_strategy_alert_mail_content(raw_message)
+
+def load_corpus(directory: str = None) -> list:
+    '''Real .eml files if directory given, synthetic mails otherwise'''
+    if directory:
+        corpus = []
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith('.eml'):
+                with open(os.path.join(directory, file_name), 'rb') as eml_file:
+                    corpus.append(eml_file.read())
+        return corpus
+    return [
+        tradingview_mail(ticker=ticker, html_rows=html_rows)
+        for ticker in ('RIG', 'SPCE', 'ENDP')
+        for html_rows in (50, 200, 1000, 5000)
+    ]
+
+def run(extract, corpus: list, rounds: int) -> tuple:
+    '''Mean microseconds per mail and count of successfully parsed mails'''
+    parsed = 0
+    for raw_message in corpus:
+        try:
+            extract(raw_message)
+            parsed += 1
+        except ValueError:
+            pass
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for raw_message in corpus:
+            try:
+                extract(raw_message)
+            except ValueError:
+                pass
+    return (time.perf_counter() - started) / (rounds * len(corpus)) * 1e6, parsed
+
+def check_wrap_offsets(offsets: int = 240) -> None:
+    '''
+    Text before marker shifts soft line breaks over markers and alert,
+    split markers must fall back to mime parsing, never to broken mail
+    '''
+    fallbacks = 0
+    for offset in range(offsets):
+        raw_message = tradingview_mail(html_rows=2, preamble='x' * offset)
+        strategy_alert = get_strategy_alert_mail_content(raw_message)
+        if strategy_alert.ticker != 'RIG' or strategy_alert.quantity != 1:
+            raise SystemExit(f'wrap offset {offset}: wrong alert {strategy_alert}')
+        try:
+            StrategyAlert.parse_raw(extract_raw_alert_json(raw_message) or '')
+        except ValueError:
+            fallbacks += 1
+    print(f'wrap offsets: parsed {offsets}/{offsets}, mime fallback for {fallbacks}')
+
+def main() -> None:
+    '''Print timings for both extractors'''
+    check_wrap_offsets()
+    corpus = load_corpus(sys.argv[1] if len(sys.argv) > 1 else None)
+    total_kb = sum(len(raw_message) for raw_message in corpus) / 1024
+    print(f'{len(corpus)} mails, {total_kb:.0f} KB')
+    for name, extract in (('legacy', legacy_extract), ('bytes', current_extract)):
+        microseconds, parsed = run(extract, corpus, 50)
+        print(f'{name:<8}{microseconds:>10.1f} us/mail  parsed {parsed}/{len(corpus)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+'''
+Alert to placed order through bot.py against local mock servers
+
+python -m benchmarks.end_to_end --path webhook --alerts 200 --strategies 20 --latency 0.02
+paths: webhook, mail-idle, mail-poll
+'''
+
+import io
+import os
+import json
+import time
+import asyncio
+import imaplib
+import argparse
+import tempfile
+import importlib
+import contextlib
+import urllib.request
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import src.settings as settings
+from .payloads import tradingview_mail
+from .mock_imap_server import start_mock_imap_server
+from .mock_tinkoff_server import (
+    MockTinkoffState,
+    start_mock_tinkoff_server,
+    api_url
+)
+
+WEBHOOK_SECRET = 'benchmark'
+
+
+def percentiles(samples: list) -> str:
+    '''p50/p90/p99/max in milliseconds'''
+    ordered = sorted(samples)
+    pick = lambda percent: ordered[min(len(ordered) - 1, int(percent / 100 * len(ordered)))]
+    return (
+        f'p50={pick(50) * 1000:.1f}ms p90={pick(90) * 1000:.1f}ms '
+        f'p99={pick(99) * 1000:.1f}ms max={ordered[-1] * 1000:.1f}ms'
+    )
+
+def alert_body(ticker: str) -> bytes:
+    '''Alert json, position never chains so alerts are not netted'''
+    return json.dumps({
+        'ticker': ticker,
+        'order_action': 'buy',
+        'quantity': 1,
+        'price': 5,
+        'position': 0,
+        'market_position': 'long',
+        'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    }).encode()
+
+class AlertSender:
+    '''Pushes alerts through chosen ingest path'''
+
+    def __init__(self, path: str, webhook_port: int, imap_server) -> None:
+        self.path = path
+        self.webhook_port = webhook_port
+        self.imap_server = imap_server
+
+    def prepare(self, strategy_name: str, ticker: str) -> tuple:
+        '''Build alert outside of measured time'''
+        if self.path == 'webhook':
+            return strategy_name, alert_body(ticker)
+        raw_message = tradingview_mail(strategy_name, ticker, html_rows=200)
+        return strategy_name, raw_message.replace(
+            b'&#34;position&#34;: 1', b'&#34;position&#34;: 0'
+        )
+
+    def send(self, prepared: tuple) -> None:
+        '''Deliver prepared alert'''
+        strategy_name, payload = prepared
+        if self.path == 'webhook':
+            urllib.request.urlopen(urllib.request.Request(
+                f'http://127.0.0.1:{self.webhook_port}/alert/{strategy_name}?secret={WEBHOOK_SECRET}',
+                data=payload,
+                method='POST'
+            )).read()
+        else:
+            self.imap_server.mailbox.append(payload)
+
+def configure(arguments, tinkoff_url: str, imap_server, strategies: dict) -> None:
+    '''Settings must be patched before bot and modules are imported'''
+    settings.TINKOFF_API_URL = tinkoff_url
+    settings.STRATEGIES = strategies
+    settings.STRATEGY_ACCOUNTS = { # mock has Tinkoff and TinkoffIis accounts
+        strategy_name: ('Tinkoff', 'TinkoffIis')[number % 2]
+        for number, strategy_name in enumerate(strategies)
+    } if arguments.accounts == 2 else {}
+    settings.ENABLE_TELEGRAM_MODULE = False
+    settings.ENABLE_WEBHOOK_MODULE = arguments.path == 'webhook'
+    settings.ENABLE_MAIL_MODULE = arguments.path != 'webhook'
+    settings.MAIL_INGEST_MODE = 'idle' if arguments.path == 'mail-idle' else 'poll'
+    settings.WEBHOOK_ADDRESS = '127.0.0.1'
+    settings.WEBHOOK_PORT = arguments.webhook_port
+    settings.WEBHOOK_SECRET = WEBHOOK_SECRET
+    settings.INSTRUMENT_CACHE_PATH = os.path.join(tempfile.mkdtemp(), 'instruments.json')
+    settings.TINKOFF_RATE_LIMITS = {} if not arguments.rate_limits else settings.TINKOFF_RATE_LIMITS
+
+    if imap_server:
+        from src.modules import mail_handler
+        host, port = imap_server.server_address[:2]
+
+        def rise_mock_mail_connection() -> imaplib.IMAP4:
+            mail = imaplib.IMAP4(host, port)
+            mail.login('benchmark', 'benchmark')
+            return mail
+
+        mail_handler.rise_mail_connection = rise_mock_mail_connection
+
+def wait_orders(state: MockTinkoffState, count: int, timeout: float = 60) -> None:
+    '''Spin until mock received count market orders'''
+    deadline = time.monotonic() + timeout
+    while len(state.market_orders) < count:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{len(state.market_orders)}/{count} orders placed')
+        time.sleep(0.0005)
+
+def measure(arguments, state: MockTinkoffState, sender: AlertSender, strategies: dict) -> list:
+    '''Sequential latency, then burst throughput, returns report lines'''
+    strategy_items = list(strategies.items())
+    latencies = []
+    for number in range(arguments.alerts):
+        prepared = sender.prepare(*strategy_items[number % len(strategy_items)])
+        placed = len(state.market_orders)
+        started = time.monotonic()
+        sender.send(prepared)
+        wait_orders(state, placed + 1)
+        latencies.append(state.market_orders[placed][0] - started)
+
+    burst = [
+        sender.prepare(*strategy_items[number % len(strategy_items)])
+        for number in range(arguments.alerts)
+    ]
+    placed = len(state.market_orders)
+    started = time.monotonic()
+    with ThreadPoolExecutor(16) as executor:
+        for prepared in burst:
+            executor.submit(sender.send, prepared)
+    wait_orders(state, placed + arguments.alerts)
+    elapsed = time.monotonic() - started
+
+    return [
+        f'path={arguments.path} strategies={len(strategies)} alerts={arguments.alerts} '
+        f'api latency={arguments.latency * 1000:.0f}ms',
+        f'alert -> order latency: {percentiles(latencies)}',
+        f'burst throughput: {arguments.alerts / elapsed:.1f} orders/s'
+    ]
+
+def main() -> None:
+    '''Start mocks, run bot event loop in background, measure'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', choices=('webhook', 'mail-idle', 'mail-poll'), default='webhook')
+    parser.add_argument('--alerts', type=int, default=200)
+    parser.add_argument('--strategies', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--webhook-port', type=int, default=18080)
+    parser.add_argument('--rate-limits', action='store_true', help='keep tinkoff quotas')
+    parser.add_argument('--accounts', type=int, choices=(1, 2), default=1, help='broker accounts')
+    arguments = parser.parse_args()
+
+    strategies = {f'BENCH_{number:03d}': f'T{number:03d}' for number in range(arguments.strategies)}
+    state = MockTinkoffState(
+        tickers=list(strategies.values()),
+        latency=arguments.latency,
+        error_rate=arguments.error_rate
+    )
+    tinkoff_server = start_mock_tinkoff_server(state)
+    imap_server = start_mock_imap_server() if arguments.path != 'webhook' else None
+    configure(arguments, api_url(tinkoff_server), imap_server, strategies)
+    bot = importlib.import_module('bot')
+
+    sender = AlertSender(arguments.path, arguments.webhook_port, imap_server)
+    loop = asyncio.new_event_loop()
+    with contextlib.redirect_stdout(io.StringIO()): # bot console logs
+        bot_task = loop.create_task(bot.async_main())
+        loop.run_until_complete(asyncio.sleep(1)) # prefetch and ingest startup
+        report = loop.run_until_complete(loop.run_in_executor(
+            None,
+            measure, arguments, state, sender, strategies
+        ))
+        bot_task.cancel()
+        loop.run_until_complete(asyncio.sleep(0.2)) # pending console notifications
+    from src.modules.metrics import STAGE_LATENCY, ALERTS
+    print('\n'.join(report))
+    print(STAGE_LATENCY.summary().replace(', ', '\n  '))
+    print(ALERTS.summary())
+    print(f'api calls: {state.calls}')
+    if arguments.accounts > 1:
+        account_orders = {}
+        for order in state.market_orders:
+            account_orders[order[4]] = account_orders.get(order[4], 0) + 1
+        print(f'orders by account: {account_orders}')
+    os._exit(0) # daemon ingest threads and executors
+
+if __name__ == '__main__':
+    main()
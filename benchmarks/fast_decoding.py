@@ -0,0 +1,43 @@
+'''
+Per-call CPU of strict pydantic validation vs fast construct decoding
+
+python -m benchmarks.fast_decoding
+'''
+
+import time
+from src.modules.tinkoff_api import parse_tinkoff_response
+from src.modules.tinkoff_classes import (
+    OrderbookResponse,
+    PortfolioResponse,
+    OperationsResponse
+)
+from .payloads import (
+    orderbook_payload,
+    portfolio_payload,
+    operations_payload
+)
+
+
+def cpu_per_call(response_content: bytes, response_model, fast: bool, calls: int) -> float:
+    '''Mean process time of one parse in microseconds'''
+    started = time.process_time()
+    for _ in range(calls):
+        parse_tinkoff_response(response_content, response_model, fast)
+    return (time.process_time() - started) / calls * 1e6
+
+def main() -> None:
+    '''Print table of strict and fast decoding timings'''
+    cases = (
+        ('orderbook depth 20', orderbook_payload(20), OrderbookResponse, 5000),
+        ('portfolio x50', portfolio_payload(), PortfolioResponse, 500),
+        ('operations x1000', operations_payload(), OperationsResponse, 20),
+        ('operations x10000', operations_payload(10000), OperationsResponse, 3)
+    )
+    print(f'{"payload":<20}{"strict us":>14}{"fast us":>14}{"speedup":>10}')
+    for name, response_content, response_model, calls in cases:
+        strict = cpu_per_call(response_content, response_model, False, calls)
+        fast = cpu_per_call(response_content, response_model, True, calls)
+        print(f'{name:<20}{strict:>14.1f}{fast:>14.1f}{strict / fast:>9.2f}x')
+
+if __name__ == '__main__':
+    main()
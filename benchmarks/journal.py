@@ -0,0 +1,90 @@
+'''
+Caller latency of background group commit journal vs inline commit per entry
+
+python -m benchmarks.journal --entries 10000
+'''
+
+import os
+import time
+import json
+import sqlite3
+import argparse
+import tempfile
+from decimal import Decimal
+import src.settings as settings
+
+
+def percentile(samples: list, percent: float) -> float:
+    '''Nearest-rank percentile in microseconds'''
+    ordered = sorted(samples)
+    return ordered[max(0, round(percent / 100 * len(ordered)) - 1)] * 1e6
+
+def main() -> None:
+    '''Record entries both ways and print latency, throughput and query timings'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=10000)
+    arguments = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    settings.JOURNAL_DB_PATH = os.path.join(directory, 'journal.sqlite3')
+    from src.modules.mail_handler import StrategyAlert
+    from src.modules.journal import Journal, SCHEMA, JOURNAL_ENTRIES
+    alert = StrategyAlert(
+        ticker='RIG',
+        order_action='buy',
+        quantity=3,
+        price=Decimal('4.25'),
+        position=3,
+        market_position='long',
+        time='2021-10-01T10:00:00Z'
+    )
+    strategies = [f'STRATEGY_{number}' for number in range(20)]
+
+    connection = sqlite3.connect(os.path.join(directory, 'inline.sqlite3'))
+    connection.executescript(SCHEMA)
+    inline_samples = []
+    started = time.monotonic()
+    for number in range(arguments.entries):
+        entry_started = time.perf_counter()
+        with connection:
+            connection.execute(
+                'INSERT INTO journal '
+                '(time, kind, strategy, figi, broker_id, trace_id, payload) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), 'alert', strategies[number % 20], f'FIGI{number % 50}',
+                 None, number, alert.json())
+            )
+        inline_samples.append(time.perf_counter() - entry_started)
+    inline_total = time.monotonic() - started
+
+    journal = Journal()
+    journal.start()
+    journal_samples = []
+    started = time.monotonic()
+    for number in range(arguments.entries):
+        entry_started = time.perf_counter()
+        journal.record('alert', alert, f'FIGI{number % 50}', strategy_name=strategies[number % 20])
+        journal_samples.append(time.perf_counter() - entry_started)
+    journal.flush(60)
+    journal_total = time.monotonic() - started
+
+    print(f'entries={arguments.entries}')
+    print(f'{"mode":<22}{"p50 us":>10}{"p99 us":>10}{"total s":>10}')
+    for name, samples, total in (
+        ('inline commit', inline_samples, inline_total),
+        ('background journal', journal_samples, journal_total)
+    ):
+        print(f'{name:<22}{percentile(samples, 50):>10.1f}{percentile(samples, 99):>10.1f}{total:>10.2f}')
+
+    print(JOURNAL_ENTRIES.summary(), f'(queue size {settings.JOURNAL_QUEUE_SIZE})')
+    for name, query in (
+        ('strategy, last 100', lambda: journal.query(strategy_name='STRATEGY_7', limit=100)),
+        ('figi, last hour', lambda: journal.query(figi='FIGI3', since=time.time() - 3600)),
+        ('time range, all', lambda: journal.query(since=time.time() - 3600, until=time.time()))
+    ):
+        started = time.perf_counter()
+        entries = query()
+        print(f'query {name}: {len(entries)} entries in {(time.perf_counter() - started) * 1000:.1f}ms')
+    print(json.dumps(journal.query(limit=1)[0]['payload']))
+
+if __name__ == '__main__':
+    main()
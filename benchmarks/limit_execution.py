@@ -0,0 +1,103 @@
+'''
+Limit execution simulator against mock tinkoff server
+
+python -m benchmarks.limit_execution --orders 40 --limit-fill-time 2 --timeout 3
+fill rate, api calls and price improvement over market orders
+'''
+
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import src.settings as settings
+from .mock_tinkoff_server import (
+    MockTinkoffState,
+    start_mock_tinkoff_server,
+    api_url
+)
+
+
+def configure(arguments, tinkoff_url: str) -> None:
+    '''Settings must be patched before modules are imported'''
+    settings.TINKOFF_API_URL = tinkoff_url
+    settings.TINKOFF_RATE_LIMITS = {}
+    settings.INSTRUMENT_CACHE_PATH = os.path.join(tempfile.mkdtemp(), 'instruments.json')
+    settings.LIMIT_ORDER_TIMEOUT = arguments.timeout
+    settings.LIMIT_FIRST_POLL = arguments.first_poll
+    settings.LIMIT_REPRICES = arguments.reprices
+
+def main() -> None:
+    '''Run executions concurrently on event loop and print summary'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=40)
+    parser.add_argument('--lots', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=8, help='api threads')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--limit-fill-time', type=float, default=2.0)
+    parser.add_argument('--timeout', type=float, default=3.0)
+    parser.add_argument('--first-poll', type=float, default=0.5)
+    parser.add_argument('--reprices', type=int, default=1)
+    arguments = parser.parse_args()
+
+    tickers = ('RIG', 'SPCE')
+    state = MockTinkoffState(
+        tickers,
+        latency=arguments.latency,
+        limit_fill_time=arguments.limit_fill_time
+    )
+    configure(arguments, api_url(start_mock_tinkoff_server(state)))
+    from src.modules.instrument_cache import INSTRUMENTS
+    from src.modules.limit_execution import execute_limit_order
+    INSTRUMENTS.prefetch(tickers)
+
+    api_executor = ThreadPoolExecutor(arguments.threads)
+
+    async def run_blocking(function, *args):
+        return await asyncio.get_running_loop().run_in_executor(api_executor, function, *args)
+
+    async def execute(number: int):
+        figi = state.figi_by_ticker(tickers[number % len(tickers)])
+        started = time.monotonic()
+        execution = await execute_limit_order(
+            figi,
+            'Buy' if number % 2 == 0 else 'Sell',
+            arguments.lots,
+            None,
+            run_blocking
+        )
+        return execution, time.monotonic() - started
+
+    async def execute_all() -> list:
+        return await asyncio.gather(*(execute(number) for number in range(arguments.orders)))
+
+    results = asyncio.run(execute_all())
+
+    executions = [execution for execution, elapsed in results]
+    total_lots = sum(execution.executed_lots for execution in executions)
+    limit_lots = sum(execution.limit_lots for execution in executions)
+    improvement_ticks = 0.0
+    for operation in state.operations:
+        market_price = state.prices[operation['figi']] + (
+            0.01 if operation['operationType'] == 'Buy' else -0.01
+        )
+        sign = 1 if operation['operationType'] == 'Buy' else -1
+        improvement_ticks += sign * (market_price - operation['price']) / 0.01 * operation['quantity']
+
+    print(
+        f'orders={arguments.orders} lots={arguments.lots} mean passive fill={arguments.limit_fill_time}s '
+        f'timeout={arguments.timeout}s reprices={arguments.reprices}'
+    )
+    print(f'filled lots: {total_lots}/{arguments.orders * arguments.lots}')
+    print(f'limit fill rate: {limit_lots / total_lots:.1%} of lots, '
+          f'{sum(1 for execution in executions if execution.market_order is None) / len(executions):.1%} orders without market fallback')
+    print(f'api calls per order: {sum(execution.api_calls for execution in executions) / len(executions):.2f} '
+          f'(market only: 1.00)')
+    print(f'mean execution time: {sum(elapsed for _, elapsed in results) / len(results):.2f}s')
+    print(f'price improvement vs market: {improvement_ticks / total_lots:.2f} ticks per lot')
+    print(f'api calls: {state.calls}')
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Minimal plain-text IMAP server for alert ingest benchmarks
+Supports what mail dispatcher uses: LOGIN, SELECT, CAPABILITY,
+UID SEARCH/FETCH/STORE and IDLE with EXISTS push on new mail
+'''
+
+import re
+import threading
+import socketserver
+
+
+def parse_uid_set(uid_set: str, max_uid: int) -> set:
+    '''b"1:3,5,7:*" style set to uids'''
+    uids = set()
+    for uid_range in uid_set.split(','):
+        first, _, last = uid_range.partition(':')
+        first = max_uid if first == '*' else int(first)
+        last = first if not last else (max_uid if last == '*' else int(last))
+        uids.update(range(min(first, last), max(first, last) + 1))
+    return uids
+
+class MockMailbox:
+    '''Inbox shared by all connections'''
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.messages = [] # [uid, raw_message, seen]
+        self.idlers = set()
+
+    def append(self, raw_message: bytes) -> None:
+        '''Deliver new mail and push EXISTS to idling connections'''
+        with self.lock:
+            self.messages.append([len(self.messages) + 1, raw_message, False])
+            announce = b'* %d EXISTS\r\n' % len(self.messages)
+            for wfile in list(self.idlers):
+                try:
+                    wfile.write(announce)
+                    wfile.flush()
+                except OSError:
+                    self.idlers.discard(wfile)
+
+class MockImapHandler(socketserver.StreamRequestHandler):
+    '''One imap session'''
+    disable_nagle_algorithm = True
+
+    def reply(self, *lines: bytes) -> None:
+        with self.server.mailbox.lock:
+            self.wfile.write(b''.join(lines))
+            self.wfile.flush()
+
+    def handle(self) -> None:
+        mailbox = self.server.mailbox
+        self.reply(b'* OK [CAPABILITY IMAP4rev1 IDLE] mock imap ready\r\n')
+        known = 0 # mailbox size this session was told about
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, command_line = line.decode().strip().partition(' ')
+            command, _, arguments = command_line.partition(' ')
+            command = command.upper()
+            if command == 'UID':
+                command, _, arguments = arguments.partition(' ')
+                command = 'UID ' + command.upper()
+            done = f'{tag} OK {command} completed\r\n'.encode()
+
+            if command == 'CAPABILITY':
+                self.reply(b'* CAPABILITY IMAP4rev1 IDLE\r\n', done)
+            elif command == 'SELECT':
+                known = len(mailbox.messages)
+                self.reply(b'* %d EXISTS\r\n' % known, done)
+            elif command == 'LOGOUT':
+                self.reply(b'* BYE\r\n', done)
+                return
+            elif command == 'IDLE':
+                self.reply(b'+ idling\r\n')
+                with mailbox.lock:
+                    mailbox.idlers.add(self.wfile)
+                    if len(mailbox.messages) > known: # arrived since last command
+                        self.wfile.write(b'* %d EXISTS\r\n' % len(mailbox.messages))
+                        self.wfile.flush()
+                self.rfile.readline() # DONE
+                with mailbox.lock:
+                    mailbox.idlers.discard(self.wfile)
+                self.reply(done)
+            elif command == 'UID SEARCH':
+                with mailbox.lock:
+                    uids = [str(uid) for uid, raw, seen in mailbox.messages if not seen]
+                    known = len(mailbox.messages)
+                self.reply(('* SEARCH ' + ' '.join(uids)).strip().encode() + b'\r\n', done)
+            elif command == 'UID FETCH':
+                uid_set = arguments.split(' ', 1)[0]
+                with mailbox.lock:
+                    requested = parse_uid_set(uid_set, len(mailbox.messages))
+                    lines = [
+                        b'* %d FETCH (UID %d BODY[] {%d}\r\n' % (uid, uid, len(raw)) + raw + b')\r\n'
+                        for uid, raw, seen in mailbox.messages if uid in requested
+                    ]
+                self.reply(*lines, done)
+            elif command == 'UID STORE':
+                uid_set = arguments.split(' ', 1)[0]
+                with mailbox.lock:
+                    requested = parse_uid_set(uid_set, len(mailbox.messages))
+                    for message in mailbox.messages:
+                        if message[0] in requested and re.search(r'\\Seen', arguments):
+                            message[2] = True
+                self.reply(done)
+            else: # LOGIN, NOOP and everything else
+                self.reply(done)
+
+def start_mock_imap_server(host: str = '127.0.0.1', port: int = 0) -> socketserver.ThreadingTCPServer:
+    '''Serve in daemon thread, mailbox is server.mailbox'''
+    server = socketserver.ThreadingTCPServer((host, port), MockImapHandler)
+    server.daemon_threads = True
+    server.mailbox = MockMailbox()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,330 @@
+'''
+Local stand-in for tinkoff openapi with latency and error injection
+
+python -m benchmarks.mock_tinkoff_server --port 18081 --latency 0.02 --error-rate 0.01
+then run the bot with TINKOFF_API_URL=http://127.0.0.1:18081/openapi/
+'''
+
+import json
+import time
+import random
+import argparse
+import threading
+import itertools
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_TICKERS = ('RIG', 'SPCE', 'ENDP', 'VEON')
+
+
+class MockTinkoffState:
+    '''Instruments, orders and positions of the mock broker'''
+
+    def __init__(
+        self,
+        tickers=DEFAULT_TICKERS,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        limit_fill_time: float = 2.0
+    ) -> None:
+        self.latency = latency
+        self.limit_fill_time = limit_fill_time
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.order_ids = itertools.count(1)
+        self.instruments = {}
+        self.prices = {}
+        for number, ticker in enumerate(tickers):
+            self.add_instrument(ticker, 5 + number)
+        self.positions = {}
+        self.active_orders = {}
+        self.operations = []
+        self.market_orders = []
+        self.limit_fills = []
+        self.limit_fill_times = {}
+        self.calls = {}
+
+    def add_instrument(self, ticker: str, price: float) -> str:
+        '''Register stock, returns its figi'''
+        figi = f'BBGMOCK{len(self.instruments):05d}'
+        self.instruments[figi] = {
+            'figi': figi,
+            'ticker': ticker,
+            'isin': f'US{len(self.instruments):010d}',
+            'minPriceIncrement': 0.01,
+            'lot': 1,
+            'currency': 'USD',
+            'name': f'{ticker} Inc',
+            'type': 'Stock'
+        }
+        self.prices[figi] = price
+        return figi
+
+    def figi_by_ticker(self, ticker: str) -> str:
+        '''Figi of registered ticker'''
+        for figi, instrument in self.instruments.items():
+            if instrument['ticker'] == ticker:
+                return figi
+        raise KeyError(ticker)
+
+    def fill(self, figi: str, operation: str, lots: int, price: float, order_id: str) -> None:
+        '''Apply executed lots to positions and operations, operation id is order id'''
+        signed_lots = lots if operation == 'Buy' else -lots
+        self.positions[figi] = self.positions.get(figi, 0) + signed_lots
+        self.operations.append({
+            'id': order_id,
+            'status': 'Done',
+            'trades': [{
+                'tradeId': str(len(self.operations) + 1),
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime()),
+                'price': price,
+                'quantity': lots
+            }],
+            'commission': {'currency': 'USD', 'value': -0.01 * lots},
+            'currency': 'USD',
+            'payment': -price * signed_lots,
+            'price': price,
+            'quantity': lots,
+            'quantityExecuted': lots,
+            'figi': figi,
+            'instrumentType': 'Stock',
+            'isMarginCall': False,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime()),
+            'operationType': operation
+        })
+
+    def fill_due_limit_orders(self) -> None:
+        '''
+        Passive limit orders fill completely after random
+        exponential time with mean limit_fill_time
+        '''
+        now = time.monotonic()
+        for order_id, fills_at in list(self.limit_fill_times.items()):
+            if fills_at <= now:
+                order = self.active_orders.pop(order_id)
+                del self.limit_fill_times[order_id]
+                self.fill(order['figi'], order['operation'], order['requestedLots'], order['price'], order_id)
+                self.limit_fills.append((now, order['figi'], order['operation'], order['requestedLots']))
+
+    def orderbook(self, figi: str, depth: int) -> dict:
+        '''Symmetric book around current price'''
+        price = self.prices[figi]
+        return {
+            'figi': figi,
+            'depth': depth,
+            'bids': [
+                {'price': round(price - 0.01 * (level + 1), 2), 'quantity': 100 * (level + 1)}
+                for level in range(depth)
+            ],
+            'asks': [
+                {'price': round(price + 0.01 * (level + 1), 2), 'quantity': 100 * (level + 1)}
+                for level in range(depth)
+            ],
+            'tradeStatus': 'NormalTrading',
+            'minPriceIncrement': 0.01,
+            'lastPrice': price,
+            'closePrice': price
+        }
+
+    def handle(self, method: str, endpoint: str, params: dict, body: dict):
+        '''Payload for endpoint, raises KeyError for unknown ones'''
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.fill_due_limit_orders()
+            if (method, endpoint) == ('POST', 'orders/market-order'):
+                order_id = str(next(self.order_ids))
+                figi = params['figi']
+                price = self.prices[figi] + (0.01 if body['operation'] == 'Buy' else -0.01)
+                self.fill(figi, body['operation'], body['lots'], price, order_id)
+                self.market_orders.append((
+                    time.monotonic(),
+                    figi,
+                    body['operation'],
+                    body['lots'],
+                    params.get('brokerAccountId')
+                ))
+                return {
+                    'orderId': order_id,
+                    'operation': body['operation'],
+                    'status': 'Fill',
+                    'requestedLots': body['lots'],
+                    'executedLots': body['lots'],
+                    'commission': {'currency': 'USD', 'value': 0.01 * body['lots']}
+                }
+            if (method, endpoint) == ('POST', 'orders/limit-order'):
+                order_id = str(next(self.order_ids))
+                figi = params['figi']
+                crosses = (
+                    body['price'] >= self.prices[figi] + 0.01 if body['operation'] == 'Buy'
+                    else body['price'] <= self.prices[figi] - 0.01
+                )
+                if crosses: # marketable limit, filled at once
+                    self.fill(figi, body['operation'], body['lots'], body['price'], order_id)
+                    self.limit_fills.append((time.monotonic(), figi, body['operation'], body['lots']))
+                    return {
+                        'orderId': order_id,
+                        'operation': body['operation'],
+                        'status': 'Fill',
+                        'requestedLots': body['lots'],
+                        'executedLots': body['lots']
+                    }
+                self.limit_fill_times[order_id] = time.monotonic() + \
+                    self.random.expovariate(1 / self.limit_fill_time)
+                self.active_orders[order_id] = {
+                    'orderId': order_id,
+                    'figi': params['figi'],
+                    'operation': body['operation'],
+                    'status': 'New',
+                    'requestedLots': body['lots'],
+                    'executedLots': 0,
+                    'type': 'Limit',
+                    'price': body['price']
+                }
+                return {
+                    'orderId': order_id,
+                    'operation': body['operation'],
+                    'status': 'New',
+                    'requestedLots': body['lots'],
+                    'executedLots': 0
+                }
+            if (method, endpoint) == ('POST', 'orders/cancel'):
+                del self.active_orders[params['orderId']]
+                self.limit_fill_times.pop(params['orderId'], None)
+                return {}
+            if endpoint == 'orders':
+                return list(self.active_orders.values())
+            if endpoint == 'portfolio':
+                return {'positions': [
+                    {
+                        'figi': figi,
+                        'ticker': self.instruments[figi]['ticker'],
+                        'instrumentType': 'Stock',
+                        'balance': lots,
+                        'lots': lots,
+                        'name': self.instruments[figi]['name']
+                    } for figi, lots in self.positions.items() if lots
+                ]}
+            if endpoint == 'portfolio/currencies':
+                return {'currencies': [{'currency': 'USD', 'balance': 10000}]}
+            if endpoint == 'market/orderbook':
+                return self.orderbook(params['figi'], int(params.get('depth', 20)))
+            if endpoint == 'market/search/by-ticker':
+                instruments = [
+                    instrument for instrument in self.instruments.values()
+                    if instrument['ticker'] == params['ticker']
+                ]
+                return {'total': len(instruments), 'instruments': instruments}
+            if endpoint == 'market/search/by-figi':
+                return self.instruments[params['figi']]
+            if endpoint == 'market/stocks':
+                instruments = list(self.instruments.values())
+                return {'total': len(instruments), 'instruments': instruments}
+            if endpoint == 'operations':
+                figi = params.get('figi')
+                return {'operations': [
+                    operation for operation in self.operations
+                    if figi is None or operation['figi'] == figi
+                ]}
+            if endpoint == 'user/accounts':
+                return {'accounts': [
+                    {'brokerAccountId': 'MOCK000001', 'brokerAccountType': 'Tinkoff'},
+                    {'brokerAccountId': 'MOCK000002', 'brokerAccountType': 'TinkoffIis'}
+                ]}
+        raise KeyError(endpoint)
+
+class MockTinkoffHandler(BaseHTTPRequestHandler):
+    '''Keep-alive json api handler, state lives on server'''
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # headers and body are separate writes
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def respond(self, http_status: int, status: str, payload) -> None:
+        content = json.dumps({
+            'trackingId': f'mock{random.getrandbits(32):08x}',
+            'status': status,
+            'payload': payload
+        }).encode()
+        self.send_response(http_status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def serve(self, method: str) -> None:
+        state = self.server.state
+        url = urlsplit(self.path)
+        endpoint = url.path.split('/openapi/', 1)[-1].strip('/')
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length', 0))
+        raw_body = self.rfile.read(length) if length else b''
+        body = json.loads(raw_body) if raw_body.strip() not in (b'', b'null') else {}
+
+        if state.latency or state.jitter:
+            time.sleep(state.latency + state.random.random() * state.jitter)
+        if state.random.random() < state.error_rate:
+            self.respond(500, 'Error', {'message': 'injected error', 'code': 'INTERNAL_ERROR'})
+            return
+        try:
+            self.respond(200, 'Ok', state.handle(method, endpoint, params, body))
+        except KeyError as e:
+            self.respond(500, 'Error', {'message': f'unknown {e}', 'code': 'VALIDATION_ERROR'})
+
+    def do_GET(self) -> None:
+        self.serve('GET')
+
+    def do_POST(self) -> None:
+        self.serve('POST')
+
+def start_mock_tinkoff_server(
+    state: MockTinkoffState,
+    host: str = '127.0.0.1',
+    port: int = 0
+) -> ThreadingHTTPServer:
+    '''Serve in daemon thread, api url is http://host:port/openapi/'''
+    server = ThreadingHTTPServer((host, port), MockTinkoffHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def api_url(server: ThreadingHTTPServer) -> str:
+    '''TINKOFF_API_URL for running server'''
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}/openapi/'
+
+def main() -> None:
+    '''Run standalone until interrupted'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--limit-fill-time', type=float, default=2.0)
+    parser.add_argument('--tickers', default=','.join(DEFAULT_TICKERS))
+    arguments = parser.parse_args()
+    server = start_mock_tinkoff_server(
+        MockTinkoffState(
+            arguments.tickers.split(','),
+            arguments.latency,
+            arguments.jitter,
+            arguments.error_rate,
+            limit_fill_time=arguments.limit_fill_time
+        ),
+        arguments.host,
+        arguments.port
+    )
+    print(f'TINKOFF_API_URL={api_url(server)}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+'''Synthetic tinkoff api payloads shaped like real responses'''
+
+import json
+from email.charset import Charset, QP
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+
+def market_order_payload() -> bytes:
+    '''/orders/market-order response'''
+    return json.dumps({
+        'trackingId': 'a1b2c3d4e5',
+        'status': 'Ok',
+        'payload': {
+            'orderId': '123456789',
+            'operation': 'Buy',
+            'status': 'Fill',
+            'rejectReason': None,
+            'message': None,
+            'requestedLots': 1,
+            'executedLots': 1,
+            'commission': {'currency': 'USD', 'value': 0.05}
+        }
+    }).encode()
+
+def portfolio_payload(positions: int = 50) -> bytes:
+    '''/portfolio response'''
+    return json.dumps({
+        'trackingId': 'a1b2c3d4e5',
+        'status': 'Ok',
+        'payload': {'positions': [
+            {
+                'figi': f'BBG00{i:07d}',
+                'ticker': f'T{i}',
+                'isin': f'US{i:010d}',
+                'instrumentType': 'Stock',
+                'balance': 10 + i,
+                'blocked': 0,
+                'expectedYield': {'currency': 'USD', 'value': 1.25},
+                'lots': 10 + i,
+                'averagePositionPrice': {'currency': 'USD', 'value': 12.34},
+                'averagePositionPriceNoNkd': {'currency': 'USD', 'value': 12.34},
+                'name': f'Company {i}'
+            } for i in range(positions)
+        ]}
+    }).encode()
+
+def operations_payload(operations: int = 1000) -> bytes:
+    '''/operations response'''
+    return json.dumps({
+        'trackingId': 'a1b2c3d4e5',
+        'status': 'Ok',
+        'payload': {'operations': [
+            {
+                'id': str(100000 + i),
+                'status': 'Done',
+                'trades': [{
+                    'tradeId': str(200000 + i),
+                    'date': '2021-09-17T13:50:00+03:00',
+                    'price': 12.34,
+                    'quantity': 1
+                }],
+                'commission': {'currency': 'USD', 'value': -0.05},
+                'currency': 'USD',
+                'payment': -12.34,
+                'price': 12.34,
+                'quantity': 1,
+                'quantityExecuted': 1,
+                'figi': 'BBG000BH5LT6',
+                'instrumentType': 'Stock',
+                'isMarginCall': False,
+                'date': '2021-09-17T13:50:00+03:00',
+                'operationType': 'Buy'
+            } for i in range(operations)
+        ]}
+    }).encode()
+
+def orderbook_payload(depth: int = 20) -> bytes:
+    '''/market/orderbook response'''
+    return json.dumps({
+        'trackingId': 'a1b2c3d4e5',
+        'status': 'Ok',
+        'payload': {
+            'figi': 'BBG000BH5LT6',
+            'depth': depth,
+            'bids': [{'price': round(12.34 - 0.01 * i, 2), 'quantity': 100 + i} for i in range(depth)],
+            'asks': [{'price': round(12.35 + 0.01 * i, 2), 'quantity': 100 + i} for i in range(depth)],
+            'tradeStatus': 'NormalTrading',
+            'minPriceIncrement': 0.01,
+            'lastPrice': 12.35,
+            'closePrice': 12.30,
+            'limitUp': 13.5,
+            'limitDown': 11.1
+        }
+    }).encode()
+
+def tradingview_mail(
+    strategy_name: str = 'RIG_TEST',
+    ticker: str = 'RIG',
+    html_rows: int = 200,
+    preamble: str = 'Your alert was triggered\r\n'
+) -> bytes:
+    '''
+    multipart/alternative alert mail like TradingView sends:
+    quoted-printable text and html parts, quotes escaped as &#34;
+    Text before marker moves quoted-printable soft line breaks of text part
+    '''
+    alert_json = json.dumps({
+        'ticker': ticker,
+        'order_action': 'buy',
+        'quantity': 1,
+        'price': 5.25,
+        'position': 1,
+        'market_position': 'long',
+        'time': '2021-09-17T13:50:00Z'
+    }).replace('"', '&#34;')
+    alert_message = f'MESSAGE_START{alert_json}MESSAGE_END'
+
+    html_body = (
+        '<html><head><style>td {font-family: -apple-system, BlinkMacSystemFont;'
+        ' color: #131722; padding: 8px 16px;}</style></head><body><table width="100%">'
+        + ''.join(
+            f'<tr><td class="row-{i}" style="border-bottom: 1px solid #e0e3eb;">'
+            f'&nbsp;</td></tr>' for i in range(html_rows // 2)
+        )
+        + f'<tr><td style="font-size: 14px;">{alert_message}</td></tr>'
+        + ''.join(
+            f'<tr><td class="row-{i}" style="border-bottom: 1px solid #e0e3eb;">'
+            f'&nbsp;</td></tr>' for i in range(html_rows // 2)
+        )
+        + '</table></body></html>'
+    )
+    utf8_qp = Charset('utf-8')
+    utf8_qp.body_encoding = QP
+    mail = MIMEMultipart('alternative')
+    mail['From'] = 'TradingView <noreply@tradingview.com>'
+    mail['Subject'] = f'Alert: {strategy_name}'
+    mail.attach(MIMEText(f'{preamble}{alert_message}\r\n', 'plain', utf8_qp))
+    mail.attach(MIMEText(html_body, 'html', utf8_qp))
+    return mail.as_bytes().replace(b'\n', b'\r\n') # as delivered by imap
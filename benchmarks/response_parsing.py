@@ -0,0 +1,50 @@
+'''
+Per-call CPU of response parsing, legacy pipeline vs single parse
+
+python -m benchmarks.response_parsing
+'''
+
+import json
+import time
+from src.modules.tinkoff_api import parse_tinkoff_response
+from src.modules.tinkoff_classes import (
+    TinkoffBaseResponse,
+    MarketOrderResponse,
+    PortfolioResponse,
+    OperationsResponse
+)
+from .payloads import (
+    market_order_payload,
+    portfolio_payload,
+    operations_payload
+)
+
+
+def legacy_parse(response_content: bytes, response_model):
+    '''.json() -> json.dumps -> status parse_raw -> model parse_raw'''
+    response_json = json.dumps(json.loads(response_content))
+    TinkoffBaseResponse.parse_raw(response_json)
+    return response_model.parse_raw(response_json)
+
+def cpu_per_call(parse, response_content: bytes, response_model, calls: int) -> float:
+    '''Mean process time of one parse in microseconds'''
+    started = time.process_time()
+    for _ in range(calls):
+        parse(response_content, response_model)
+    return (time.process_time() - started) / calls * 1e6
+
+def main() -> None:
+    '''Print table of legacy and single parse timings'''
+    cases = (
+        ('market order', market_order_payload(), MarketOrderResponse, 5000),
+        ('portfolio x50', portfolio_payload(), PortfolioResponse, 500),
+        ('operations x1000', operations_payload(), OperationsResponse, 20)
+    )
+    print(f'{"endpoint":<18}{"legacy us":>14}{"single us":>14}{"speedup":>10}')
+    for name, response_content, response_model, calls in cases:
+        legacy = cpu_per_call(legacy_parse, response_content, response_model, calls)
+        single = cpu_per_call(parse_tinkoff_response, response_content, response_model, calls)
+        print(f'{name:<18}{legacy:>14.1f}{single:>14.1f}{legacy / single:>9.2f}x')
+
+if __name__ == '__main__':
+    main()
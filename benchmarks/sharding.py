@@ -0,0 +1,123 @@
+'''
+Burst throughput of webhook alerts with strategies sharded across processes
+
+python -m benchmarks.sharding --shards 1 --strategies 40 --alerts 400
+python -m benchmarks.sharding --shards 4 --strategies 40 --alerts 400
+--shards 1 runs bot in one process, more starts coordinator and shard processes
+'''
+
+import io
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import importlib
+import contextlib
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import src.settings as settings
+from .end_to_end import (
+    WEBHOOK_SECRET,
+    alert_body,
+    wait_orders
+)
+from .mock_tinkoff_server import (
+    MockTinkoffState,
+    start_mock_tinkoff_server,
+    api_url
+)
+
+
+def configure_process() -> None:
+    '''Settings which are not read from environment, both coordinator and shards'''
+    settings.ENABLE_TELEGRAM_MODULE = False
+    settings.ENABLE_MAIL_MODULE = False
+    settings.ENABLE_WEBHOOK_MODULE = True
+    settings.ENABLE_ORDERBOOK_SAMPLER = False
+    settings.WEBHOOK_ADDRESS = '127.0.0.1'
+    settings.TINKOFF_RATE_LIMITS = {}
+
+def run_benchmark_shard(shard_number: int, strategies: dict, connection) -> None:
+    '''Shard process target, configures settings before bot is imported'''
+    configure_process()
+    with contextlib.redirect_stdout(io.StringIO()):
+        importlib.import_module('bot').run_shard(shard_number, strategies, connection)
+
+def main() -> None:
+    '''Start mock and bot, send burst to shard ports, print orders per second'''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=2)
+    parser.add_argument('--strategies', type=int, default=40)
+    parser.add_argument('--alerts', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--webhook-port', type=int, default=18180)
+    arguments = parser.parse_args()
+
+    strategies = {f'BENCH_{number:03d}': f'T{number:03d}' for number in range(arguments.strategies)}
+    state = MockTinkoffState(tickers=list(strategies.values()), latency=arguments.latency)
+    os.environ.update({ # inherited by spawned shards
+        'TINKOFF_API_URL': api_url(start_mock_tinkoff_server(state)),
+        'INSTRUMENT_CACHE_PATH': os.path.join(tempfile.mkdtemp(), 'instruments.json'),
+        'WEBHOOK_SECRET': WEBHOOK_SECRET,
+        'WEBHOOK_PORT': str(arguments.webhook_port),
+        'SHARD_PROCESSES': str(arguments.shards)
+    })
+    for name in ('TINKOFF_API_URL', 'INSTRUMENT_CACHE_PATH', 'WEBHOOK_SECRET'):
+        setattr(settings, name, os.environ[name])
+    settings.WEBHOOK_PORT = arguments.webhook_port
+    settings.SHARD_PROCESSES = arguments.shards
+    settings.STRATEGIES = strategies
+    configure_process()
+    bot = importlib.import_module('bot')
+    from src.modules.sharding import split_strategies, get_shard_port
+
+    ports = {}
+    for shard_number, shard_strategies in enumerate(split_strategies(strategies, arguments.shards)):
+        for strategy_name in shard_strategies:
+            ports[strategy_name] = get_shard_port(arguments.webhook_port, shard_number)
+
+    def send(number: int) -> None:
+        strategy_name, ticker = list(strategies.items())[number % len(strategies)]
+        urllib.request.urlopen(urllib.request.Request(
+            f'http://127.0.0.1:{ports[strategy_name]}/alert/{strategy_name}?secret={WEBHOOK_SECRET}',
+            data=alert_body(ticker),
+            method='POST'
+        )).read()
+
+    def measure() -> float:
+        for number in range(len(strategies)): # every shard is up and warm
+            for attempt in range(100):
+                try:
+                    send(number)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        wait_orders(state, len(strategies))
+        placed = len(state.market_orders)
+        started = time.monotonic()
+        with ThreadPoolExecutor(32) as executor:
+            list(executor.map(send, range(arguments.alerts)))
+        wait_orders(state, placed + arguments.alerts)
+        return arguments.alerts / (time.monotonic() - started)
+
+    loop = asyncio.new_event_loop()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if arguments.shards > 1:
+            bot_task = loop.create_task(bot.async_coordinator_main(run_benchmark_shard))
+        else:
+            bot_task = loop.create_task(bot.async_main())
+        throughput = loop.run_until_complete(loop.run_in_executor(None, measure))
+        with contextlib.redirect_stderr(io.StringIO()): # mock sees shard connections reset
+            bot_task.cancel()
+            loop.run_until_complete(asyncio.sleep(0.5))
+    print(
+        f'shards={arguments.shards} strategies={arguments.strategies} alerts={arguments.alerts} '
+        f'api latency={arguments.latency * 1000:.0f}ms cpus={os.cpu_count()}'
+    )
+    print(f'burst throughput: {throughput:.1f} orders/s')
+    print(f'api calls: {state.calls}')
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,79 @@
 '''main executing script'''
-import threading
 import time
+import asyncio
+import threading
+import contextvars
+from typing import Optional
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import ValidationError
 from requests import RequestException
 from src.settings import (
-    STRATEGIES,
-    ENABLED_DATABASE_LOGS,
-    ENABLE_TELEGRAM_MODULE
+    STRATEGIES_FILE,
+    SHARD_PROCESSES,
+    WEBHOOK_PORT,
+    TINKOFF_POOL_SIZE,
+    ORDER_SIZING_MODE,
+    ORDER_EXECUTION_MODE,
+    ENABLE_ORDERBOOK_SAMPLER,
+    ORDERBOOK_SAMPLE_INTERVAL,
+    PORTFOLIO_RECONCILE_INTERVAL,
+    METRICS_PORT,
+    METRICS_ADDRESS,
+    METRICS_FILE,
+    TRACES_FILE,
+    METRICS_FILE_INTERVAL,
+    ENABLE_MAIL_MODULE,
+    ENABLE_WEBHOOK_MODULE,
+    ENABLE_TELEGRAM_MODULE,
+    ENABLED_DATABASE_LOGS
 )
 from src.modules.mail_handler import (
-    get_strategy_status_from_mail,
-    rise_mail_connection
+    MailDispatcher,
+    sustain_mail_dispatcher,
+    signed_quantity
+)
+from src.modules.webhook_handler import start_webhook_server
+from src.modules.metrics_export import (
+    start_metrics_server,
+    export_metrics_files
+)
+from src.modules.metrics import (
+    ALERT_TO_ORDER_LATENCY,
+    CURRENT_TRACE,
+    AlertTrace,
+    timed_stage
+)
+from src.modules.order_executor import (
+    OrderJob,
+    OrderExecutor
+)
+from src.modules.supervisor import SUPERVISOR
+from src.modules.strategy_registry import STRATEGY_REGISTRY
+from src.modules.sharding import (
+    Coordinator,
+    split_strategies,
+    get_shard_port,
+    get_shard_path,
+    connect_coordinator
+)
+from src.modules.tinkoff_api import (
+    TinkoffError,
+    BROKER_ACCOUNTS
+)
+from src.modules.instrument_cache import INSTRUMENTS
+from src.modules.journal import JOURNAL
+from src.modules.portfolio_store import PORTFOLIO
+from src.modules.orderbook_sampler import ORDERBOOKS
+from src.modules.limit_execution import (
+    LimitExecution,
+    execute_limit_order
 )
-from src.modules.tinkoff_api import TinkoffError
 from src.modules.tinkoff_highlvl import (
     get_figi_by_ticker,
-    create_market_order
+    get_target_delta,
+    create_market_order,
+    create_target_position_order
 )
 from src.modules.telegram_module import (
     create_telegram_bot,
@@ -26,6 +84,12 @@ from src.modules.telegram_module import (
     telegram_executed_order_log
 )
 
+API_EXECUTOR = ThreadPoolExecutor(TINKOFF_POOL_SIZE, 'thread tinkoff api')
+'''Blocking tinkoff calls, one thread per pooled connection'''
+
+class StrategyDown(Exception):
+    '''Strategy cannot continue trading'''
+
 def create_telegram_bot_thread() -> None:
     '''Handle all incoming messages'''
     thread = threading.Thread(
@@ -35,100 +99,486 @@ def create_telegram_bot_thread() -> None:
     thread.name = 'thread telegram bot'
     thread.start()
 
-def handle_strategy_alert(strategy_alert, figi: str, bot) -> None:
-    '''Making decisions and catching exceptions'''
+async def sustain_mail_dispatcher_task(dispatcher: MailDispatcher) -> None:
+    '''One blocking mail connection in daemon thread, finishes when it dies'''
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+
+    def sustain_and_report() -> None:
+        try:
+            sustain_mail_dispatcher(dispatcher)
+        finally:
+            loop.call_soon_threadsafe(stopped.set_result, None)
+
+    thread = threading.Thread(
+            target=sustain_and_report,
+            daemon=True
+        )
+    thread.name = 'thread mail dispatcher'
+    thread.start()
+    await stopped
+
+async def run_blocking(function, *args):
+    '''
+    Await blocking api call without blocking event loop
+    Current trace goes along into api thread
+    '''
+    return await asyncio.get_running_loop().run_in_executor(
+        API_EXECUTOR,
+        partial(contextvars.copy_context().run, function, *args)
+    )
+
+def create_alert_deliver(loop: asyncio.AbstractEventLoop, alert_queues: dict):
+    '''
+    Thread-safe deliver function shared by mail and webhook ingest
+    Queue is looked up on the loop, alert of just removed strategy is dropped
+    '''
+
+    def put_alert(strategy_name: str, strategy_alert) -> None:
+        alert_queue = alert_queues.get(strategy_name)
+        if alert_queue is None:
+            print(f'alert of removed strategy {strategy_name} dropped')
+            return
+        alert_queue.put_nowait(strategy_alert)
+
+    def deliver(strategy_name: str, strategy_alert) -> None:
+        loop.call_soon_threadsafe(put_alert, strategy_name, strategy_alert)
+
+    return deliver
+
+async def execute_limit_alert(
+    strategy_alert,
+    figi: str,
+    broker_id: Optional[str]
+) -> Optional[LimitExecution]:
+    '''
+    Limit mode order of alert, waits for fills on event loop
+    None without api call if holding is already at target
+    '''
+    if ORDER_SIZING_MODE == 'target': # job runs serialized for its (account, figi) key, holding is stable
+        held_lots = await run_blocking(PORTFOLIO.get(broker_id).get_lots, figi) # remote in shard
+        lots = get_target_delta(strategy_alert, figi, held_lots)
+    else:
+        lots = signed_quantity(strategy_alert)
+    if not lots:
+        return None
+    return await execute_limit_order(
+        figi,
+        'Buy' if lots > 0 else 'Sell',
+        abs(lots),
+        broker_id,
+        run_blocking
+    )
+
+async def handle_strategy_alert(
+    strategy_alert,
+    figi: str,
+    bot,
+    broker_id: Optional[str] = None
+) -> str:
+    '''
+    Making decisions and catching exceptions
+    Returns outcome: executed, skipped or failed
+    '''
 
     try:
-        executed_order = create_market_order(strategy_alert, figi)
+        if ORDER_EXECUTION_MODE == 'limit':
+            executed_order = await execute_limit_alert(strategy_alert, figi, broker_id)
+        elif ORDER_SIZING_MODE == 'target': # job runs serialized for its (account, figi) key, holding is stable
+            executed_order = await run_blocking(
+                create_target_position_order,
+                strategy_alert,
+                figi,
+                PORTFOLIO.get(broker_id), # remote store blocks, read in api thread
+                broker_id
+            )
+        else:
+            executed_order = await run_blocking(create_market_order, strategy_alert, figi, broker_id)
     except RequestException as e:
         telegram_basic_error_log(bot, 'requests error')
+        return 'failed'
     except ValidationError as e:
         telegram_basic_error_log(bot, e.json())
-        exit()
+        raise StrategyDown from e
         #print(e.json())
     except TinkoffError as e:
         telegram_basic_error_log(bot, f'tinkoff got error {e.message}')
-        exit()
+        raise StrategyDown from e
         #print(e.message)
     except Exception as e:
         telegram_basic_error_log(bot, f'some really unexpectable error: {e}')
-        exit()
+        raise StrategyDown from e
         #print('some really unexpectable error')
     else:
-        telegram_executed_order_log(bot, executed_order)
+        if executed_order is None:
+            print(f'{figi} already at target position')
+            return 'skipped'
+        executed_at = time.monotonic()
+        PORTFOLIO.get(broker_id).apply_order(figi, executed_order)
+        with timed_stage('notify'):
+            telegram_executed_order_log(bot, executed_order)
+        trace = CURRENT_TRACE.get()
+        if trace is not None: # last, nothing after order placement may fail on it
+            ALERT_TO_ORDER_LATENCY.observe(executed_at - trace.started_at)
+        return 'executed'
+
+def create_order_executor(telegram_bot) -> OrderExecutor:
+    '''Worker pool placing orders for all strategies'''
+
+    async def execute_order_job(job: OrderJob) -> None:
+        trace = job.strategy_alert._trace or AlertTrace(job.strategy_name, 'unknown')
+        trace.mark('order_worker')
+        if ENABLE_ORDERBOOK_SAMPLER:
+            trace.expected_price = ORDERBOOKS.estimate_fill_price( # last sample, no request
+                job.figi,
+                job.strategy_alert.order_action.capitalize(),
+                job.strategy_alert.quantity
+            )
+        CURRENT_TRACE.set(trace) # worker task context, one job at a time
+        JOURNAL.record('alert', job.strategy_alert, job.figi, job.broker_id)
+        outcome = 'failed'
+        try:
+            outcome = await handle_strategy_alert(
+                job.strategy_alert,
+                job.figi,
+                telegram_bot,
+                job.broker_id
+            )
+        finally:
+            CURRENT_TRACE.set(None)
+            trace.finish(outcome)
+
+    return OrderExecutor(execute_order_job)
+
+def restart_on_strategy_down(strategy_name: str, order_done: asyncio.Future) -> None:
+    '''Fatal order error restarts strategy which sent the alert, others keep trading'''
+    if not order_done.cancelled() and isinstance(order_done.exception(), StrategyDown):
+        SUPERVISOR.fail(strategy_name, order_done.exception().__cause__ or order_done.exception())
 
-def create_trading_threads() -> list:
+async def resolve_accounts(strategies: dict, accounts: dict) -> dict:
     '''
-    Creating and starting trading threads
-    Returns list of created threads
+    Canonical broker account id of every strategy, account type, its id
+    and default account become one id for lanes, positions and order keys
+    First unknown account requests /user/accounts, misconfigured one
+    raises ValueError before trading starts
     '''
-    created_trading_threads = []
-    for strategy_name, ticker in STRATEGIES.items():
-        thread = threading.Thread(
-            target=sustain_trading_thread,
-            args=(strategy_name, ticker),
-            daemon=True
-        )
-        thread.name = 'thread ' + strategy_name
-        created_trading_threads.append(thread)
-        thread.start()
-    return created_trading_threads
+    return {
+        strategy_name: await run_blocking(BROKER_ACCOUNTS.resolve, accounts.get(strategy_name))
+        for strategy_name in strategies
+    }
 
+def get_accounts(broker_ids: dict) -> list:
+    '''Distinct canonical accounts traded by strategies'''
+    return sorted(set(broker_ids.values()))
 
-def sustain_trading_thread(strategy_name: str, ticker: str):
-    '''All in-thread actions and logic'''
+async def prepare_accounts(accounts: list, reconcile: bool) -> None:
+    '''Register canonical accounts for portfolio reconciliation'''
+    for broker_id in accounts:
+        store = PORTFOLIO.get(broker_id)
+        if reconcile and ORDER_SIZING_MODE == 'target': # deltas need real holding from the start
+            await run_blocking(store.reconcile)
 
-    mail_connection = rise_mail_connection()
-    figi = get_figi_by_ticker(ticker)
-    telegram_bot = create_telegram_bot()
-    telegram_basic_log(
-        telegram_bot,
-        f'started {threading.current_thread().getName()}'
-    )
+def supervise_order_lanes(accounts: list, telegram_bot) -> dict:
+    '''
+    Order executor with own queue and workers per broker account,
+    orders of different accounts never wait for each other
+    '''
+    order_executors = {}
+    for broker_id in accounts:
+        order_executor = order_executors[broker_id] = create_order_executor(telegram_bot)
+        for number in range(order_executor.workers):
+            SUPERVISOR.supervise(
+                f'order worker {broker_id} {number}',
+                lambda state, order_executor=order_executor: order_executor.sustain_worker()
+            )
+    return order_executors
+
+def supervise_trading_tasks(
+    strategies: dict,
+    broker_ids: dict,
+    alert_queues: dict,
+    order_executors: dict,
+    telegram_bot
+) -> None:
+    '''
+    Start supervised trading task per strategy on lane of its canonical account
+    Alert queue outlives restarts, so no alert is lost
+    '''
+    for strategy_name, ticker in strategies.items():
+        broker_id = broker_ids[strategy_name]
+        SUPERVISOR.supervise(
+            strategy_name,
+            partial(
+                sustain_trading_task,
+                strategy_name,
+                ticker,
+                alert_queues[strategy_name],
+                order_executors[broker_id],
+                broker_id,
+                telegram_bot
+            )
+        )
+
+async def sustain_trading_task(
+    strategy_name: str,
+    ticker: str,
+    alert_queue: asyncio.Queue,
+    order_executor: OrderExecutor,
+    broker_id: Optional[str],
+    telegram_bot,
+    state: dict
+) -> None:
+    '''All in-task actions and logic, figi is kept in state across restarts'''
+
+    if 'figi' not in state:
+        with timed_stage('figi_lookup'):
+            state['figi'] = await run_blocking(get_figi_by_ticker, ticker)
+    figi = state['figi']
+    telegram_basic_log(telegram_bot, f'started task {strategy_name}')
 
     while True:
-        time.sleep(1)
-        strategy_alert = get_strategy_status_from_mail(strategy_name, mail_connection)
-        print(threading.current_thread().name, end=': ')
-        if strategy_alert == 'NoMail':
-            pass
-        elif strategy_alert == 'TooManyMails':
-            telegram_basic_error_log(telegram_bot, 'too many mails') # raise mail sequence error
+        strategy_alert = await alert_queue.get() # routed by mail dispatcher
+        if strategy_alert == 'BrokenMail':
+            telegram_basic_error_log(telegram_bot, f'cannot parse alert for {strategy_name}')
         else:
             #telegram_strategy_alert_log(telegram_bot, strategy_alert)
-            handle_strategy_alert(strategy_alert, figi, telegram_bot)
+            if strategy_alert._trace is not None:
+                strategy_alert._trace.mark('dequeued')
+            order_done = await order_executor.submit(
+                OrderJob(strategy_name, strategy_alert, figi, broker_id)
+            )
+            order_done.add_done_callback(
+                partial(restart_on_strategy_down, strategy_name)
+            )
 
-def sustain_main_thread(active_trading_threads: list) -> None:
-    '''Look after other threads'''
+def create_strategy_applier(
+    telegram_bot,
+    alert_queues: dict,
+    order_executors: dict,
+    dispatcher: Optional[MailDispatcher],
+    reconcile: bool
+):
+    '''
+    Coroutine applying strategy registry changes
+    Only added strategies are warmed: their tickers are prefetched
+    and new accounts get order lanes before anything is stopped,
+    so bad ticker or account leaves running strategies untouched
+    '''
 
-    telegram_bot = create_telegram_bot()
-    active_threads_count_should_be = (
-            len(STRATEGIES) +
-            int(ENABLED_DATABASE_LOGS is True) +
-            int(ENABLE_TELEGRAM_MODULE is True) * 7 + # with 4 workers
-            1 # with main thread
-        )
+    async def apply(added: dict, added_accounts: dict, removed: list) -> None:
+        await run_blocking(INSTRUMENTS.prefetch, added.values())
+        for ticker in added.values():
+            if ticker not in INSTRUMENTS.by_ticker:
+                raise ValueError(f'unknown ticker {ticker}')
+        broker_ids = await resolve_accounts(added, added_accounts)
+        new_accounts = [
+            broker_id for broker_id in get_accounts(broker_ids)
+            if broker_id not in order_executors
+        ]
+        await prepare_accounts(new_accounts, reconcile)
+        order_executors.update(supervise_order_lanes(new_accounts, telegram_bot))
+
+        for strategy_name in removed:
+            SUPERVISOR.stop(strategy_name)
+            dropped = alert_queues.pop(strategy_name).qsize()
+            if dropped:
+                telegram_basic_error_log(telegram_bot, f'{dropped} alerts of {strategy_name} dropped')
+        for strategy_name in added:
+            alert_queues[strategy_name] = asyncio.Queue()
+        supervise_trading_tasks(added, broker_ids, alert_queues, order_executors, telegram_bot)
+
+        if ENABLE_ORDERBOOK_SAMPLER:
+            traded_tickers = set(added.values()) | {
+                ticker for strategy_name, ticker in STRATEGY_REGISTRY.strategies.items()
+                if strategy_name not in removed
+            }
+            ORDERBOOKS.untrack(
+                INSTRUMENTS.get_by_ticker(STRATEGY_REGISTRY.strategies[strategy_name]).figi
+                for strategy_name in removed
+                if STRATEGY_REGISTRY.strategies[strategy_name] not in traded_tickers
+            )
+            ORDERBOOKS.track( # prefetched, no requests
+                INSTRUMENTS.get_by_ticker(ticker).figi for ticker in added.values()
+            )
+        if dispatcher is not None:
+            dispatcher.strategy_names = set(alert_queues) # swapped, never mutated under mail thread
+
+    return apply
+
+async def sustain_portfolio_reconciliation(telegram_bot) -> None:
+    '''Periodically compare local positions with tinkoff portfolio'''
+
+    try:
+        PORTFOLIO.get(await run_blocking(BROKER_ACCOUNTS.resolve)) # default account is always tracked
+    except ValueError: # token without Tinkoff account
+        pass
+    while True:
+        try:
+            account_divergences = await run_blocking(PORTFOLIO.reconcile)
+        except (RequestException, TinkoffError, ValidationError) as e:
+            telegram_basic_error_log(telegram_bot, f'portfolio reconcile failed: {e}')
+        else:
+            for broker_id, divergences in account_divergences.items():
+                for figi, expected_lots, actual_lots in divergences:
+                    telegram_basic_error_log(
+                        telegram_bot,
+                        f'position {figi} on {broker_id} account: '
+                        f'expected {expected_lots} lots, portfolio has {actual_lots}'
+                    )
+        await asyncio.sleep(PORTFOLIO_RECONCILE_INTERVAL)
+
+async def sustain_orderbook_sampler() -> None:
+    '''
+    Refresh orderbooks of traded figis one by one,
+    so sampling never takes more than one api thread
+    '''
+    while True:
+        for figi in list(ORDERBOOKS.figis):
+            try:
+                await run_blocking(ORDERBOOKS.sample, figi)
+            except (RequestException, TinkoffError) as e:
+                print(f'orderbook {figi} sample failed: {e}')
+        await asyncio.sleep(ORDERBOOK_SAMPLE_INTERVAL)
 
+async def sustain_metrics_export(metrics_path: Optional[str], traces_path: Optional[str]) -> None:
+    '''Write metrics and traces files periodically'''
     while True:
-        time.sleep(0.5)
-        active_threads_count = len(threading.enumerate())
+        await asyncio.sleep(METRICS_FILE_INTERVAL)
+        await asyncio.get_running_loop().run_in_executor(
+            None, # disk io, not an api thread
+            export_metrics_files,
+            metrics_path,
+            traces_path
+        )
+
+def supervise_metrics_export(shard_number: Optional[int] = None) -> None:
+    '''Metrics endpoint and files of this process, shards get own port and files'''
+    if METRICS_PORT:
+        start_metrics_server(
+            METRICS_PORT if shard_number is None else get_shard_port(METRICS_PORT, shard_number + 1),
+            METRICS_ADDRESS
+        )
+    if METRICS_FILE or TRACES_FILE:
+        metrics_path = get_shard_path(METRICS_FILE, shard_number)
+        traces_path = get_shard_path(TRACES_FILE, shard_number)
+        SUPERVISOR.supervise(
+            'metrics export',
+            lambda state: sustain_metrics_export(metrics_path, traces_path)
+        )
+
+async def async_main(
+    strategies: Optional[dict] = None,
+    telegram_bot=None,
+    shard_number: Optional[int] = None
+) -> None:
+    '''
+    Supervised trading tasks, mail and webhook ingest on one event loop
+    Strategies come from live registry, shard process gets fixed part
+    of them and coordinator client as telegram bot,
+    positions are reconciled by coordinator then
+    '''
+
+    telegram_bot = telegram_bot or create_telegram_bot()
+    SUPERVISOR.notify = partial(telegram_basic_error_log, telegram_bot)
+    alert_queues = {}
+    deliver = create_alert_deliver(asyncio.get_running_loop(), alert_queues)
+    dispatcher = MailDispatcher((), deliver) if ENABLE_MAIL_MODULE else None
+    telegram_basic_log(telegram_bot, await STRATEGY_REGISTRY.start(
+        create_strategy_applier(
+            telegram_bot,
+            alert_queues,
+            {}, # order executors by account
+            dispatcher,
+            shard_number is None
+        ),
+        strategies
+    ))
+    if shard_number is None:
+        SUPERVISOR.supervise(
+            'portfolio reconciliation',
+            lambda state: sustain_portfolio_reconciliation(telegram_bot)
+        )
+        if STRATEGIES_FILE:
+            SUPERVISOR.supervise(
+                'strategies file',
+                lambda state: STRATEGY_REGISTRY.sustain_watching(
+                    partial(telegram_basic_log, telegram_bot)
+                )
+            )
+    if ENABLE_ORDERBOOK_SAMPLER:
+        SUPERVISOR.supervise(
+            'orderbook sampler',
+            lambda state: sustain_orderbook_sampler()
+        )
+    if dispatcher is not None: # after strategies, so their unseen mails are routed
+        SUPERVISOR.supervise(
+            'mail dispatcher',
+            lambda state: sustain_mail_dispatcher_task(dispatcher)
+        )
+    if ENABLE_WEBHOOK_MODULE:
+        start_webhook_server(
+            STRATEGY_REGISTRY.strategies, # live, checked on every request
+            deliver,
+            get_shard_port(WEBHOOK_PORT, shard_number or 0)
+        )
+    supervise_metrics_export(shard_number)
+    await SUPERVISOR.wait() # only when every worker gave up
+    await run_blocking(telegram_bot.flush, 5) # last errors before exit
+    await run_blocking(JOURNAL.flush, 5)
+
+def run_shard(shard_number: int, strategies: dict, connection) -> None:
+    '''Shard process entry, account-level state lives in coordinator'''
+    coordinator_client = connect_coordinator(connection)
+    if ENABLED_DATABASE_LOGS:
+        JOURNAL.start()
+    asyncio.run(async_main(strategies, coordinator_client, shard_number))
 
-        if active_threads_count < active_threads_count_should_be:
-            for thread in active_trading_threads:
-                if not thread.is_alive():
-                    telegram_basic_error_log(telegram_bot, f'{thread.name} is down')
-                    break
-            break
+async def async_coordinator_main(shard_target=run_shard) -> None:
+    '''
+    Sharded mode: supervised shard processes trade, this process
+    serves them positions, rate limits and telegram and reconciles portfolio
+    '''
+
+    telegram_bot = create_telegram_bot()
+    SUPERVISOR.notify = partial(telegram_basic_error_log, telegram_bot)
+    all_strategies, accounts = STRATEGY_REGISTRY.get_initial() # fixed in sharded mode
+    await run_blocking(INSTRUMENTS.prefetch, all_strategies.values()) # shards start from cache file
+    await prepare_accounts(get_accounts(await resolve_accounts(all_strategies, accounts)), True)
+    coordinator = Coordinator(telegram_bot)
+    for shard_number, strategies in enumerate(split_strategies(all_strategies, SHARD_PROCESSES)):
+        telegram_basic_log(
+            telegram_bot,
+            f'shard {shard_number}: {", ".join(strategies)}' + (
+                f', webhook port {get_shard_port(WEBHOOK_PORT, shard_number)}'
+                if ENABLE_WEBHOOK_MODULE else ''
+            )
+        )
+        SUPERVISOR.supervise(
+            f'shard {shard_number}',
+            partial(coordinator.sustain_shard, shard_target, shard_number, strategies)
+        )
+    SUPERVISOR.supervise(
+        'portfolio reconciliation',
+        lambda state: sustain_portfolio_reconciliation(telegram_bot)
+    )
+    supervise_metrics_export()
+    await SUPERVISOR.wait()
+    await run_blocking(telegram_bot.flush, 5)
 
 def main():
     '''
-    Creating and watching threads
+    Creating and watching tasks
     Managing telegram bot and database
     '''
 
-    create_telegram_bot_thread()
-    active_trading_threads = create_trading_threads()
-    sustain_main_thread(active_trading_threads)
+    if ENABLE_TELEGRAM_MODULE:
+        create_telegram_bot_thread()
+    if ENABLED_DATABASE_LOGS:
+        JOURNAL.start()
+    if SHARD_PROCESSES > 1:
+        asyncio.run(async_coordinator_main())
+    else:
+        asyncio.run(async_main())
     exit()
 
 if __name__ == '__main__':
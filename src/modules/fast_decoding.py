@@ -0,0 +1,119 @@
+'''
+Validation-free decoding of trusted tinkoff responses
+
+Models are built with construct from alias-mapped json, values keep
+json types (float instead of Decimal), orderbook sides are array-backed
+'''
+
+from array import array
+from typing import Iterator, NamedTuple
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+from .tinkoff_classes import (
+    TinkoffBaseResponse,
+    OrderbookResponse
+)
+
+
+class OrderbookLevel(NamedTuple):
+    '''Price level, same attributes as OrderResponse'''
+    price: float
+    quantity: int
+
+class OrderbookSide:
+    '''Bids or asks as two parallel arrays'''
+    __slots__ = ('prices', 'quantities')
+
+    def __init__(self, levels: list) -> None:
+        self.prices = array('d', [level['price'] for level in levels])
+        self.quantities = array('q', [level['quantity'] for level in levels])
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def __getitem__(self, index: int) -> OrderbookLevel:
+        return OrderbookLevel(self.prices[index], self.quantities[index])
+
+    def __iter__(self) -> Iterator[OrderbookLevel]:
+        return map(OrderbookLevel, self.prices, self.quantities)
+
+class FastOrderBook:
+    '''Orderbook with array-backed sides, same attributes as OrderBook'''
+    __slots__ = (
+        'figi',
+        'depth',
+        'bids',
+        'asks',
+        'trade_status',
+        'min_price_increment',
+        'face_value',
+        'last_price',
+        'close_price',
+        'limit_up',
+        'limit_down'
+    )
+
+    def __init__(self, payload: dict) -> None:
+        self.figi = payload['figi']
+        self.depth = payload['depth']
+        self.bids = OrderbookSide(payload['bids'])
+        self.asks = OrderbookSide(payload['asks'])
+        self.trade_status = payload.get('tradeStatus')
+        self.min_price_increment = payload['minPriceIncrement']
+        self.face_value = payload.get('faceValue')
+        self.last_price = payload.get('lastPrice')
+        self.close_price = payload.get('closePrice')
+        self.limit_up = payload.get('limitUp')
+        self.limit_down = payload.get('limitDown')
+
+FAST_PAYLOAD_DECODERS = {
+    OrderbookResponse: FastOrderBook
+}
+'''Hand-rolled payload records used instead of construct'''
+
+MODEL_PLANS = {}
+'''Per model list of (alias, field name, nested model, is list)'''
+
+def get_model_plan(model: type[BaseModel]) -> list:
+    '''Field mapping of model, computed once'''
+    plan = MODEL_PLANS.get(model)
+    if plan is None:
+        plan = []
+        for field in model.__fields__.values():
+            nested_model = None
+            if isinstance(field.type_, type) and issubclass(field.type_, BaseModel) and \
+                    field.shape in (SHAPE_SINGLETON, SHAPE_LIST):
+                nested_model = field.type_
+            plan.append((field.alias, field.name, nested_model, field.shape == SHAPE_LIST))
+        MODEL_PLANS[model] = plan
+    return plan
+
+def construct_model(model: type[BaseModel], raw_object: dict) -> BaseModel:
+    '''Model and nested models from json object without validation'''
+    values = {}
+    for alias, name, nested_model, is_list in get_model_plan(model):
+        value = raw_object.get(alias)
+        if value is not None and nested_model is not None:
+            if is_list:
+                value = [construct_model(nested_model, item) for item in value]
+            else:
+                value = construct_model(nested_model, value)
+        values[name] = value
+    instance = model.__new__(model) # what construct does, minus defaults copying
+    object.__setattr__(instance, '__dict__', values)
+    object.__setattr__(instance, '__fields_set__', set(values))
+    return instance
+
+def construct_response(
+    response_object: dict,
+    response_model: type[TinkoffBaseResponse]
+) -> TinkoffBaseResponse:
+    '''Response model from already checked json object'''
+    payload_decoder = FAST_PAYLOAD_DECODERS.get(response_model)
+    if payload_decoder is None:
+        return construct_model(response_model, response_object)
+    return response_model.construct(
+        tracking_id=response_object.get('trackingId'),
+        status=response_object.get('status'),
+        payload=payload_decoder(response_object['payload'])
+    )
@@ -0,0 +1,144 @@
+'''On-disk ticker and figi index of market instruments'''
+
+import os
+import json
+import time
+import threading
+from typing import Optional
+from decimal import Decimal
+from pydantic import BaseModel
+from requests import RequestException
+from ..settings import (
+    INSTRUMENT_CACHE_PATH,
+    INSTRUMENT_CACHE_TTL
+)
+from .tinkoff_classes import MarketInstrument
+from .tinkoff_api import (
+    TinkoffError,
+    get_market_stocks,
+    get_stock_by_ticker
+)
+
+
+class CachedInstrument(BaseModel):
+    '''Instrument metadata needed for order placement'''
+    figi: str
+    ticker: str
+    lot: int
+    min_price_increment: Optional[Decimal]
+    currency: Optional[str]
+    updated_at: float
+
+class InstrumentIndex:
+    '''
+    In-memory index by ticker and figi backed by json file
+    Entries older than ttl are refreshed from api,
+    stale entries are still served if refresh fails
+    '''
+
+    def __init__(
+        self,
+        path: str = INSTRUMENT_CACHE_PATH,
+        ttl: float = INSTRUMENT_CACHE_TTL
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.by_ticker = {}
+        self.by_figi = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        '''Read index from disk if it exists'''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as cache_file:
+            for raw_instrument in json.load(cache_file):
+                self.put(CachedInstrument.parse_obj(raw_instrument))
+
+    def save(self) -> None:
+        '''Atomically write index to disk'''
+        with self.lock:
+            instruments = [
+                json.loads(instrument.json()) for instrument in self.by_figi.values()
+            ]
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(instruments, cache_file)
+        os.replace(temporary_path, self.path)
+
+    def put(self, instrument: CachedInstrument) -> None:
+        '''Add or replace instrument in both indexes'''
+        with self.lock:
+            self.by_ticker[instrument.ticker] = instrument
+            self.by_figi[instrument.figi] = instrument
+
+    def put_market_instrument(
+        self,
+        market_instrument: MarketInstrument,
+        updated_at: float
+    ) -> None:
+        '''Add instrument received from api'''
+        self.put(CachedInstrument(
+            figi=market_instrument.figi,
+            ticker=market_instrument.ticker,
+            lot=market_instrument.lot,
+            min_price_increment=market_instrument.min_price_increment,
+            currency=market_instrument.currency,
+            updated_at=updated_at
+        ))
+
+    def is_fresh(self, ticker: str) -> bool:
+        '''Ticker is cached and not older than ttl'''
+        instrument = self.by_ticker.get(ticker)
+        return (
+            instrument is not None and
+            time.time() - instrument.updated_at < self.ttl
+        )
+
+    def refresh_ticker(self, ticker: str) -> None:
+        '''Search api for one ticker'''
+        updated_at = time.time()
+        for market_instrument in get_stock_by_ticker(ticker)[:1]:
+            self.put_market_instrument(market_instrument, updated_at)
+
+    def prefetch(self, tickers) -> None:
+        '''
+        Warm startup: load disk index and refresh only missing or stale
+        tickers, using one stocks listing call when several are needed
+        '''
+        self.load()
+        stale_tickers = [ticker for ticker in tickers if not self.is_fresh(ticker)]
+        if not stale_tickers:
+            return
+        try:
+            if len(stale_tickers) > 1:
+                updated_at = time.time()
+                for market_instrument in get_market_stocks():
+                    if market_instrument.ticker not in self.by_ticker or \
+                            market_instrument.ticker in stale_tickers:
+                        self.put_market_instrument(market_instrument, updated_at)
+            for ticker in stale_tickers:
+                if not self.is_fresh(ticker): # not a stock or single ticker
+                    self.refresh_ticker(ticker)
+        except (RequestException, TinkoffError):
+            if any(ticker not in self.by_ticker for ticker in stale_tickers):
+                raise
+        self.save()
+
+    def get_by_ticker(self, ticker: str) -> CachedInstrument:
+        '''Cached instrument, api search only if missing or stale'''
+        if not self.is_fresh(ticker):
+            try:
+                self.refresh_ticker(ticker)
+                self.save()
+            except (RequestException, TinkoffError):
+                if ticker not in self.by_ticker:
+                    raise
+        return self.by_ticker[ticker]
+
+    def get_by_figi(self, figi: str) -> CachedInstrument:
+        '''Cached instrument by figi, dictionary hit only'''
+        return self.by_figi[figi]
+
+INSTRUMENTS = InstrumentIndex()
+'''Shared instrument index'''
@@ -0,0 +1,233 @@
+'''Append-only sqlite journal of alerts, order requests and placed orders'''
+
+import json
+import time
+import queue
+import sqlite3
+import threading
+from typing import Optional
+from datetime import datetime
+from pydantic import BaseModel
+from ..settings import (
+    JOURNAL_DB_PATH,
+    JOURNAL_QUEUE_SIZE,
+    JOURNAL_BATCH_SIZE
+)
+from .metrics import (
+    CURRENT_TRACE,
+    LatencyRecorder,
+    Counter
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    kind TEXT NOT NULL,
+    strategy TEXT,
+    figi TEXT,
+    broker_id TEXT,
+    trace_id INTEGER,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_by_time ON journal (time);
+CREATE INDEX IF NOT EXISTS journal_by_strategy ON journal (strategy, time);
+CREATE INDEX IF NOT EXISTS journal_by_figi ON journal (figi, time);
+'''
+
+JOURNAL_COMMIT = LatencyRecorder('journal commit')
+'''Duration of one group commit'''
+
+JOURNAL_ENTRIES = Counter('journal entries', 'result')
+'''Entries by result: written, dropped'''
+
+
+def get_json_default(value):
+    '''Models nested in payload as dicts, decimals and the rest as strings'''
+    if isinstance(value, BaseModel):
+        return value.dict(by_alias=True)
+    return str(value)
+
+def serialize_payload(payload) -> str:
+    '''Json text of model, dict or already serialized json'''
+    if isinstance(payload, str):
+        return payload
+    if isinstance(payload, BaseModel):
+        return payload.json(by_alias=True)
+    return json.dumps(payload, default=get_json_default)
+
+def get_timestamp(moment) -> Optional[float]:
+    '''Unix time of datetime, iso string or number'''
+    if moment is None or isinstance(moment, (int, float)):
+        return moment
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment.replace('Z', '+00:00'))
+    return moment.timestamp()
+
+class Journal:
+    '''
+    Entries are only enqueued by record, single background writer
+    drains the queue and commits everything waiting in one transaction,
+    WAL mode lets queries read while writer appends
+    Nothing is written until start, so disabled journal costs nothing
+    '''
+
+    def __init__(self, path: str = JOURNAL_DB_PATH) -> None:
+        self.path = path
+        self.queue = None
+        self.thread = None
+
+    def start(self) -> None:
+        '''Create database and run writer thread'''
+        if self.thread is not None:
+            return
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL') # durable at checkpoint, not per commit
+        connection.executescript(SCHEMA)
+        self.queue = queue.Queue(JOURNAL_QUEUE_SIZE)
+        self.thread = threading.Thread(
+            target=self.sustain_writing,
+            args=(connection,),
+            daemon=True
+        )
+        self.thread.name = 'thread journal writer'
+        self.thread.start()
+
+    def record(
+        self,
+        kind: str,
+        payload,
+        figi: Optional[str] = None,
+        broker_id: Optional[str] = None,
+        strategy_name: Optional[str] = None
+    ) -> None:
+        '''
+        Enqueue entry without blocking, strategy and trace id
+        are taken from current alert trace if not given
+        '''
+        if self.queue is None:
+            return
+        trace = CURRENT_TRACE.get()
+        if strategy_name is None and trace is not None:
+            strategy_name = trace.strategy_name
+        try:
+            self.queue.put_nowait((
+                time.time(),
+                kind,
+                strategy_name,
+                figi,
+                broker_id,
+                None if trace is None else trace.trace_id,
+                payload
+            ))
+        except queue.Full:
+            JOURNAL_ENTRIES.inc('dropped')
+
+    def collect_batch(self) -> list:
+        '''Block for first entry, then take everything waiting'''
+        batch = [self.queue.get()]
+        while len(batch) < JOURNAL_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def sustain_writing(self, connection: sqlite3.Connection) -> None:
+        '''Group commit loop, flush markers are set once their batch is committed'''
+        while True:
+            batch = self.collect_batch()
+            entries = [entry for entry in batch if isinstance(entry, tuple)]
+            if entries:
+                started = time.monotonic()
+                try:
+                    with connection:
+                        connection.executemany(
+                            'INSERT INTO journal '
+                            '(time, kind, strategy, figi, broker_id, trace_id, payload) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            [entry[:-1] + (serialize_payload(entry[-1]),) for entry in entries]
+                        )
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    print(f'journal write failed: {e}')
+                    JOURNAL_ENTRIES.inc('dropped', len(entries))
+                else:
+                    JOURNAL_ENTRIES.inc('written', len(entries))
+                JOURNAL_COMMIT.observe(time.monotonic() - started)
+            for entry in batch:
+                if isinstance(entry, threading.Event):
+                    entry.set()
+
+    def flush(self, timeout: float) -> bool:
+        '''Wait until already recorded entries are committed'''
+        if self.queue is None:
+            return True
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def query(
+        self,
+        strategy_name: Optional[str] = None,
+        figi: Optional[str] = None,
+        kind: Optional[str] = None,
+        since=None,
+        until=None,
+        limit: Optional[int] = None
+    ) -> list:
+        '''
+        Entries as dicts ordered by time, newest last
+        since and until are datetimes, iso strings or unix times
+        Limit keeps the newest entries
+        '''
+        conditions, params = [], []
+        for column, value in (('strategy', strategy_name), ('figi', figi), ('kind', kind)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        for condition, moment in (('time >= ?', since), ('time < ?', until)):
+            if moment is not None:
+                conditions.append(condition)
+                params.append(get_timestamp(moment))
+        query = 'SELECT time, kind, strategy, figi, broker_id, trace_id, payload FROM journal'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY time DESC, id DESC'
+        if limit:
+            query += f' LIMIT {int(limit)}'
+
+        connection = sqlite3.connect(self.path) # own reader, never waits for writer
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+        return [
+            {
+                'time': row[0],
+                'kind': row[1],
+                'strategy': row[2],
+                'figi': row[3],
+                'broker_id': row[4],
+                'trace_id': row[5],
+                'payload': json.loads(row[6])
+            } for row in reversed(rows)
+        ]
+
+    def summary(self, strategy_name_or_figi: str, limit: int = 10) -> str:
+        '''Human readable last entries of strategy or figi'''
+        if self.thread is None:
+            return 'journal is disabled'
+        entries = self.query(strategy_name=strategy_name_or_figi, limit=limit) or self.query(
+            figi=strategy_name_or_figi,
+            limit=limit
+        )
+        return '\n'.join(
+            f'{datetime.fromtimestamp(entry["time"]).isoformat(" ", "seconds")} '
+            f'{entry["kind"]} {entry["strategy"] or "-"} {entry["figi"] or "-"}: '
+            f'{json.dumps(entry["payload"])}'
+            for entry in entries
+        )
+
+JOURNAL = Journal()
+'''Shared journal, started by bot if ENABLED_DATABASE_LOGS'''
@@ -0,0 +1,271 @@
+'''Passive limit order execution with reprice and market fallback'''
+
+import math
+import time
+import asyncio
+from typing import Callable, Optional
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from requests import RequestException
+from ..settings import (
+    LIMIT_ORDER_TIMEOUT,
+    LIMIT_FIRST_POLL,
+    LIMIT_REPRICES,
+    LIMIT_CONFIRM_ATTEMPTS
+)
+from .tinkoff_classes import (
+    LimitOrderRequest,
+    MarketOrderRequest,
+    PlacedMarketOrder
+)
+from .tinkoff_api import (
+    TinkoffError,
+    get_orders,
+    get_orderbook,
+    get_operations,
+    post_limit_order,
+    post_market_order,
+    post_order_cancel
+)
+from .instrument_cache import INSTRUMENTS
+from .orderbook_sampler import ORDERBOOKS
+
+
+class LimitExecution:
+    '''
+    Outcome of one execution, quacks like placed order
+    for position store and telegram log
+    '''
+
+    def __init__(self, figi: str, operation: str, requested_lots: int) -> None:
+        self.figi = figi
+        self.operation = operation
+        self.requested_lots = requested_lots
+        self.executed_lots = 0
+        self.limit_lots = 0
+        self.limit_orders = 0
+        self.api_calls = 0
+        self.market_order: Optional[PlacedMarketOrder] = None
+        self.error: Optional[Exception] = None
+
+    @property
+    def status(self) -> str:
+        '''Fill when all requested lots are executed'''
+        return 'Fill' if self.executed_lots >= self.requested_lots else 'PartiallyFill'
+
+    def __str__(self) -> str:
+        return (
+            f'{self.operation} {self.figi}: {self.executed_lots}/{self.requested_lots} lots, '
+            f'{self.limit_lots} by {self.limit_orders} limit orders, '
+            f'{self.executed_lots - self.limit_lots} by market, {self.api_calls} api calls'
+            + (f', stopped by {self.error!r}' if self.error is not None else '')
+        )
+
+def round_to_increment(price: Decimal, increment: Decimal, rounding: str) -> Decimal:
+    '''Price on instrument price grid'''
+    return (price / increment).quantize(Decimal(1), rounding=rounding) * increment
+
+def get_touch(figi: str, execution: LimitExecution) -> tuple:
+    '''Best bid and ask, from sampler if fresh, requested otherwise'''
+    snapshot = ORDERBOOKS.get(figi)
+    if snapshot is not None and not math.isnan(snapshot.bid_prices[0] + snapshot.ask_prices[0]):
+        return Decimal(str(snapshot.bid_prices[0])), Decimal(str(snapshot.ask_prices[0]))
+    execution.api_calls += 1
+    orderbook = get_orderbook(figi, 1)
+    if not orderbook.bids or not orderbook.asks:
+        raise ValueError(f'empty orderbook for {figi}')
+    return Decimal(str(orderbook.bids[0].price)), Decimal(str(orderbook.asks[0].price))
+
+def get_limit_price(figi: str, operation: str, execution: LimitExecution) -> Decimal:
+    '''
+    One increment inside the spread on our side,
+    joins the touch when spread is one increment, never crosses
+    '''
+    increment = Decimal(str(INSTRUMENTS.get_by_figi(figi).min_price_increment or '0.01'))
+    best_bid, best_ask = get_touch(figi, execution)
+    if operation == 'Buy':
+        price = round_to_increment(best_bid, increment, ROUND_FLOOR)
+        if best_ask - price > increment:
+            price += increment
+    else:
+        price = round_to_increment(best_ask, increment, ROUND_CEILING)
+        if price - best_bid > increment:
+            price -= increment
+    return price
+
+def get_operation_time(moment: datetime) -> str:
+    '''Operations api date, a minute earlier for clock skew'''
+    return (moment - timedelta(minutes=1)).isoformat(timespec='seconds')
+
+def get_executed_lots(
+    order_id: str,
+    figi: str,
+    broker_id: Optional[str],
+    placed_at: datetime,
+    execution: LimitExecution
+) -> Optional[int]:
+    '''
+    Executed lots of order from its operation (operation id is order id),
+    None while operation is not visible yet
+    '''
+    execution.api_calls += 1
+    operations = get_operations(
+        get_operation_time(placed_at),
+        figi=figi,
+        broker_id=broker_id
+    )
+    operation = next(
+        (operation for operation in operations if operation.operation_id == order_id),
+        None
+    )
+    if operation is None:
+        return None
+    return (operation.quantity_executed or 0) // INSTRUMENTS.get_by_figi(figi).lot # shares to lots
+
+async def confirm_executed_lots(
+    order_id: str,
+    figi: str,
+    broker_id: Optional[str],
+    placed_at: datetime,
+    execution: LimitExecution,
+    run_blocking: Callable
+) -> Optional[int]:
+    '''
+    Lots executed by finished order, gone or not cancellable order
+    is not assumed filled, operation is awaited with doubling delays,
+    None if it never appears
+    '''
+    delay = LIMIT_FIRST_POLL
+    for attempt in range(LIMIT_CONFIRM_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(delay)
+            delay *= 2
+        executed_lots = await run_blocking(get_executed_lots, order_id, figi, broker_id, placed_at, execution)
+        if executed_lots is not None:
+            return executed_lots
+    return None
+
+async def wait_limit_order(
+    order_id: str,
+    broker_id: Optional[str],
+    execution: LimitExecution,
+    run_blocking: Callable
+) -> bool:
+    '''
+    Poll active orders with doubling intervals until order
+    is gone or timeout is reached, returns True if order is gone
+    Waits on event loop, api thread is taken only by requests
+    '''
+    deadline = time.monotonic() + LIMIT_ORDER_TIMEOUT
+    delay = LIMIT_FIRST_POLL
+    while True:
+        await asyncio.sleep(max(0, min(delay, deadline - time.monotonic())))
+        delay *= 2
+        execution.api_calls += 1
+        active_orders = await run_blocking(get_orders, broker_id)
+        if all(order.order_id != order_id for order in active_orders):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+
+async def cancel_limit_order(
+    order_id: str,
+    broker_id: Optional[str],
+    execution: LimitExecution,
+    run_blocking: Callable
+) -> bool:
+    '''Cancel resting order, returns False if it is already gone'''
+    execution.api_calls += 1
+    try:
+        await run_blocking(post_order_cancel, order_id, broker_id)
+    except TinkoffError: # filled or cancelled between last poll and cancel
+        return False
+    return True
+
+async def execute_limit_order(
+    figi: str,
+    operation: str,
+    lots: int,
+    broker_id: Optional[str],
+    run_blocking: Callable
+) -> LimitExecution:
+    '''
+    Work order with passive limits: place near touch, wait, cancel
+    and reprice up to LIMIT_REPRICES times, rest goes by market
+    Fills of every finished limit order are confirmed by its operation
+    Api error or order gone without operation stops working without
+    market fallback (reconciliation settles position), resting order
+    is cancelled whatever happens and confirmed lots are kept
+    Takes up to (LIMIT_REPRICES + 1) * LIMIT_ORDER_TIMEOUT, run_blocking(function, *args)
+    runs requests in api threads
+    '''
+    execution = LimitExecution(figi, operation, lots)
+    resting_order = None
+    try:
+        for _ in range(LIMIT_REPRICES + 1):
+            remaining_lots = lots - execution.executed_lots
+            price = await run_blocking(get_limit_price, figi, operation, execution)
+            placed_at = datetime.now(timezone.utc)
+            execution.api_calls += 1
+            execution.limit_orders += 1
+            placed_order = await run_blocking(
+                post_limit_order,
+                LimitOrderRequest(lots=remaining_lots, operation=operation, price=price),
+                figi,
+                broker_id
+            )
+            if placed_order.status == 'Rejected':
+                break
+            if placed_order.status == 'Fill':
+                filled_lots = remaining_lots
+            else:
+                resting_order = (placed_order.order_id, placed_at)
+                gone = await wait_limit_order(placed_order.order_id, broker_id, execution, run_blocking)
+                if not gone:
+                    gone = not await cancel_limit_order(placed_order.order_id, broker_id, execution, run_blocking)
+                confirmed_lots = await confirm_executed_lots(
+                    placed_order.order_id,
+                    figi,
+                    broker_id,
+                    placed_at,
+                    execution,
+                    run_blocking
+                )
+                resting_order = None
+                if confirmed_lots is None and gone: # may be filled, neither reprice nor market
+                    execution.error = ValueError(f'order {placed_order.order_id} gone without operation')
+                    break
+                filled_lots = min(remaining_lots, confirmed_lots or 0)
+            execution.executed_lots += filled_lots
+            execution.limit_lots += filled_lots
+            if execution.executed_lots >= lots:
+                return execution
+    except (RequestException, TinkoffError) as e:
+        execution.error = e
+    finally:
+        if resting_order is not None: # api error or cancelled task, order must not stay live
+            order_id, placed_at = resting_order
+            try:
+                await cancel_limit_order(order_id, broker_id, execution, run_blocking)
+                filled_lots = min(
+                    lots - execution.executed_lots,
+                    await confirm_executed_lots(order_id, figi, broker_id, placed_at, execution, run_blocking) or 0
+                )
+                execution.executed_lots += filled_lots
+                execution.limit_lots += filled_lots
+            except (RequestException, TinkoffError) as e:
+                print(f'limit order {order_id} of {figi} may stay active: {e!r}')
+    if execution.error is not None:
+        return execution
+
+    remaining_lots = lots - execution.executed_lots
+    execution.api_calls += 1
+    execution.market_order = await run_blocking(
+        post_market_order,
+        MarketOrderRequest(lots=remaining_lots, operation=operation),
+        figi,
+        broker_id
+    )
+    if execution.market_order.status != 'Rejected':
+        execution.executed_lots += remaining_lots
+    return execution
@@ -1,14 +1,30 @@
 '''Email Handler module'''
 
+import re
+import ssl
+import html
+import time
 import email
+import select
+import binascii
 import imaplib
-from typing import Union
+from email.header import decode_header, make_header
+from typing import Callable, Optional
 from decimal import Decimal
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from ..settings import (
     EMAIL_ADDRESS,
     EMAIL_PASSWORD,
-    EMAIL_SERVER
+    EMAIL_SERVER,
+    MAIL_INGEST_MODE,
+    MAIL_POLL_INTERVAL,
+    MAIL_IDLE_TIMEOUT,
+    MAIL_RECONNECT_DELAY
+)
+from .metrics import (
+    STAGE_LATENCY,
+    ALERTS,
+    AlertTrace
 )
 
 class StrategyAlert(BaseModel):
@@ -20,6 +36,7 @@ class StrategyAlert(BaseModel):
     position: int
     market_position: str
     time: str
+    _trace: Optional[AlertTrace] = PrivateAttr(default=None)
 
 def rise_mail_connection() -> imaplib.IMAP4_SSL:
     '''Open and return connection using config from settings'''
@@ -27,57 +44,347 @@ def rise_mail_connection() -> imaplib.IMAP4_SSL:
     mail.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
     return mail
 
-def get_strategy_alert_mail_content(mail_content: str) -> StrategyAlert:
-    '''From mail_content get message and convert it to json'''
-    mail_content = mail_content.replace(
-        "\r", ''
-    ).replace(
-        "\n", ''
-    ).replace(
-        '=', ''
-    )
+MESSAGE_START = b'MESSAGE_START'
+MESSAGE_END = b'MESSAGE_END'
+
+TRANSFER_ENCODING = re.compile(
+    rb'^content-transfer-encoding:[ \t]*([\w-]+)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+def find_alert_bounds(content: bytes) -> Optional[tuple]:
+    '''Start and end of text between markers without copying content'''
+    start = content.find(MESSAGE_START)
+    if start == -1:
+        return None
+    end = content.find(MESSAGE_END, start)
+    if end == -1:
+        return None
+    return start + len(MESSAGE_START), end
 
-    encoded_json_string = mail_content[
-        (mail_content.find('MESSAGE_START') +
-            len('MESSAGE_START')):mail_content.find('MESSAGE_END')
-    ]
+def get_part_end(raw_message: bytes, position: int) -> int:
+    '''Next mime boundary line after position, end of message if none'''
+    part_end = raw_message.find(b'\n--', position)
+    return len(raw_message) if part_end == -1 else part_end
 
-    encoded_json_string = encoded_json_string.replace('&#34;', '"')
+def is_quoted_printable(raw_message: bytes, position: int) -> bool:
+    '''Transfer encoding of the mime part which contains position'''
+    part_encoding = None
+    for match in TRANSFER_ENCODING.finditer(raw_message, 0, position):
+        part_encoding = match.group(1)
+    return part_encoding is not None and part_encoding.lower() == b'quoted-printable'
+
+def decode_alert_json(encoded_json: bytes, quoted_printable: bool) -> str:
+    '''Quoted-printable and html entities decoding of alert only'''
+    if quoted_printable:
+        encoded_json = binascii.a2b_qp(encoded_json)
+    alert_json = encoded_json.decode('utf-8')
+    if '&' in alert_json: # html part escapes quotes as &#34;
+        alert_json = html.unescape(alert_json)
+    return alert_json
+
+def extract_raw_alert_json(raw_message: bytes) -> Optional[str]:
+    '''
+    Alert json from raw mail bytes, markers are searched in raw bytes
+    within one mime part and only text between them is decoded
+    None if markers are split by quoted-printable soft line break
+    '''
+    start = raw_message.find(MESSAGE_START)
+    if start == -1:
+        return None
+    end = raw_message.find(MESSAGE_END, start, get_part_end(raw_message, start))
+    if end == -1:
+        return None
+    start += len(MESSAGE_START)
+    return decode_alert_json(
+        raw_message[start:end],
+        is_quoted_printable(raw_message, start)
+    )
 
-    strategy_alert = StrategyAlert.parse_raw(encoded_json_string)
-    return strategy_alert
+def extract_alert_json(raw_message: bytes) -> str:
+    '''Alert json from decoded text parts of fully parsed mail'''
+    for part in email.message_from_bytes(raw_message).walk():
+        if part.get_content_maintype() != 'text':
+            continue
+        content = part.get_payload(decode=True)
+        bounds = find_alert_bounds(content)
+        if bounds:
+            start, end = bounds
+            return decode_alert_json(content[start:end], False)
+    raise ValueError('no MESSAGE_START/MESSAGE_END in mail')
 
-def get_strategy_status_from_mail(strategy_name: str, mail: imaplib.IMAP4_SSL) -> Union[StrategyAlert, str]:
+def get_strategy_alert_mail_content(raw_message: bytes) -> StrategyAlert:
     '''
-    Receiveing mail and output:
-    StrategyAlert object if works fine
-    "NoMail" if empty mail list
-    "TooManyMails" if lost sequence
+    From raw mail get message and convert it to json
+    Raw bytes fast path first, full mime parsing if it finds no alert,
+    cannot decode it or alert is not valid, base64 parts always go there
     '''
+    try:
+        alert_json = extract_raw_alert_json(raw_message)
+        if alert_json is not None:
+            return StrategyAlert.parse_raw(alert_json)
+    except ValueError: # ValidationError and UnicodeDecodeError included
+        pass
+    return StrategyAlert.parse_raw(extract_alert_json(raw_message))
 
-    mail.select('inbox')
+def signed_quantity(strategy_alert: StrategyAlert) -> int:
+    '''Positive lots for buy, negative for sell'''
+    if strategy_alert.order_action.lower() == 'sell':
+        return -strategy_alert.quantity
+    return strategy_alert.quantity
 
-    searchable_strategy_name = (
-        '"Alert: ' + strategy_name + '"'
-    ) # special format for mail.search
+def net_strategy_alerts(strategy_alerts: list) -> list:
+    '''
+    Merge consecutive alerts of one strategy into single market order
+    Only alerts for the same ticker whose positions follow each other
+    are merged, anything else is kept as is
+    Alerts netted to zero lots are dropped
+    '''
+    netted = []
+    for strategy_alert in strategy_alerts:
+        if netted and (
+            netted[-1].ticker == strategy_alert.ticker and
+            netted[-1].position + signed_quantity(strategy_alert) == strategy_alert.position
+        ):
+            net_quantity = signed_quantity(netted[-1]) + signed_quantity(strategy_alert)
+            netted[-1] = strategy_alert.copy(update={
+                'order_action': 'buy' if net_quantity > 0 else 'sell',
+                'quantity': abs(net_quantity)
+            })
+        else:
+            netted.append(strategy_alert)
+    return [strategy_alert for strategy_alert in netted if strategy_alert.quantity]
 
-    status, data = mail.search(
-        None,
-        f'FROM "TradingView" SUBJECT {searchable_strategy_name} UNSEEN'
+def compact_uid_set(uids: list) -> bytes:
+    '''Uids as imap sequence set of ranges, [1, 2, 3, 5] -> b"1:3,5"'''
+    ranges = []
+    for uid in sorted(int(uid) for uid in uids):
+        if ranges and ranges[-1][1] + 1 == uid:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return b','.join(
+        b'%d' % first if first == last else b'%d:%d' % (first, last)
+        for first, last in ranges
     )
 
-    mail_ids = []
-    for block in data:
-        mail_ids += block.split()
+def get_mail_subject(raw_message: bytes) -> str:
+    '''
+    Decoded subject header, only header block is parsed
+    Undecodable subject (unknown charset, bad bytes) is returned as is
+    '''
+    headers_end = raw_message.find(b'\r\n\r\n')
+    if headers_end == -1:
+        headers_end = raw_message.find(b'\n\n')
+    headers = email.message_from_bytes(
+        raw_message[:headers_end] if headers_end != -1 else raw_message
+    )
+    subject = headers.get('Subject', '')
+    try:
+        return str(make_header(decode_header(subject)))
+    except (LookupError, UnicodeError):
+        return str(subject)
+
+def get_fetched_uid(data: list, number: int) -> Optional[bytes]:
+    '''
+    Uid of fetched message at data[number], server may send it
+    before the message literal or after it
+    '''
+    match = re.search(rb'UID (\d+)', data[number][0])
+    if match is None and number + 1 < len(data) and isinstance(data[number + 1], bytes):
+        match = re.search(rb'UID (\d+)', data[number + 1])
+    return match and match.group(1)
+
+class MailDispatcher:
+    '''
+    Single mail connection for all strategies
+    One search and one fetch per poll, alerts are routed
+    by mail subject to deliver(strategy_name, strategy_alert)
+    '''
+
+    def __init__(self, strategy_names, deliver: Callable) -> None:
+        self.strategy_names = set(strategy_names)
+        self.deliver = deliver
+        self.ignored_uids = set()
+        self.mail = None
+
+    def connect(self) -> None:
+        '''(Re)open mail connection and select inbox'''
+        self.mail = rise_mail_connection()
+        self.mail.select('inbox')
+
+    def supports_idle(self) -> bool:
+        '''Server announces IDLE capability after login'''
+        status, data = self.mail.capability()
+        return b'IDLE' in b' '.join(data).upper().split()
+
+    def has_buffered_data(self) -> bool:
+        '''
+        Some response bytes are already read from the socket
+        into imaplib buffer or decrypted by ssl, select cannot see them
+        '''
+        timeout = self.mail.sock.gettimeout()
+        self.mail.sock.setblocking(False)
+        try:
+            return bool(self.mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            self.mail.sock.settimeout(timeout)
+
+    def wait_for_mail(self, timeout: float) -> bool:
+        '''
+        Block in IMAP IDLE (RFC 2177) until server announces new message
+        or timeout is reached, returns True if something arrived
+        '''
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b' IDLE\r\n')
+        response = self.mail.readline()
+        if not response.startswith(b'+'):
+            raise imaplib.IMAP4.error(f'IDLE rejected: {response!r}')
+
+        announced = False
+        deadline = time.monotonic() + timeout
+        while not announced:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self.has_buffered_data():
+                readable, _, _ = select.select([self.mail.sock], [], [], remaining)
+                if not readable:
+                    break
+            response = self.mail.readline()
+            if not response:
+                raise imaplib.IMAP4.abort('connection closed while idling')
+            announced = response.startswith(b'*') and (
+                b'EXISTS' in response or b'RECENT' in response
+            )
 
-    if len(mail_ids) > 1: # how many unseen mails
-        return 'TooManyMails'
+        self.mail.send(b'DONE\r\n')
+        while not response.startswith(tag): # skip untagged till IDLE completion
+            response = self.mail.readline()
+            if not response:
+                raise imaplib.IMAP4.abort('connection closed after idling')
+        return announced
 
-    for i in mail_ids:
-        status, data = mail.fetch(i, '(RFC822)')
-        for response_part in data:
+    def route_subject(self, subject: str) -> Optional[str]:
+        '''Strategy name for the mail subject, the longest match wins'''
+        matched = None
+        for strategy_name in self.strategy_names:
+            if ('Alert: ' + strategy_name) in subject:
+                if matched is None or len(strategy_name) > len(matched):
+                    matched = strategy_name
+        return matched
+
+    def search_unseen_uids(self) -> list:
+        '''Uids of all unseen TradingView alerts'''
+        status, data = self.mail.uid(
+            'search',
+            None,
+            'FROM "TradingView" SUBJECT "Alert: " UNSEEN'
+        )
+        uids = []
+        for block in data:
+            uids += block.split()
+        return [uid for uid in uids if uid not in self.ignored_uids]
+
+    def fetch_messages(self, uids: list) -> list:
+        '''All messages for uids in one fetch as list of (uid, raw_message)'''
+        status, data = self.mail.uid(
+            'fetch',
+            compact_uid_set(uids),
+            '(BODY.PEEK[])'
+        )
+        messages = []
+        for number, response_part in enumerate(data):
             if isinstance(response_part, tuple):
-                message = email.message_from_bytes(response_part[1])
-                mail_content = message.get_payload()
-                return get_strategy_alert_mail_content(mail_content)
-    return 'NoMail'
+                uid = get_fetched_uid(data, number)
+                if uid is None:
+                    print(f'mail without uid skipped: {response_part[0]!r}')
+                    continue
+                messages.append((uid, response_part[1]))
+        return messages
+
+    def poll(self) -> int:
+        '''
+        Route every new alert to its strategy
+        Alerts of one strategy are ordered by alert time and netted
+        Delivers:
+        StrategyAlert object if works fine
+        "BrokenMail" if alert cannot be parsed
+        Returns amount of routed mails
+        '''
+        poll_started = time.monotonic()
+        uids = self.search_unseen_uids()
+        searched = time.monotonic()
+        STAGE_LATENCY.observe('mail_search', searched - poll_started)
+        if not uids:
+            return 0
+
+        routed = {}
+        messages = self.fetch_messages(uids)
+        fetched = time.monotonic()
+        STAGE_LATENCY.observe('mail_fetch', fetched - searched)
+        for uid, raw_message in messages:
+            try:
+                strategy_name = self.route_subject(get_mail_subject(raw_message))
+            except Exception as e: # one bad mail never stops ingest of the rest
+                print(f'mail {uid} ignored: {e!r}')
+                strategy_name = None
+            if strategy_name is None:
+                self.ignored_uids.add(uid) # not ours, keep it unseen
+                continue
+            routed.setdefault(strategy_name, []).append((uid, raw_message))
+
+        seen_uids = []
+        for strategy_name, messages in routed.items():
+            strategy_alerts = []
+            for uid, raw_message in messages:
+                seen_uids.append(uid)
+                ALERTS.inc('received')
+                parse_started = time.monotonic()
+                try:
+                    strategy_alert = get_strategy_alert_mail_content(raw_message)
+                except Exception: # any broken mail, ValidationError and unknown charset included
+                    ALERTS.inc('broken')
+                    self.deliver(strategy_name, 'BrokenMail')
+                    continue
+                parsed = time.monotonic()
+                STAGE_LATENCY.observe('alert_parse', parsed - parse_started)
+                strategy_alert._trace = AlertTrace(strategy_name, 'mail', poll_started)
+                strategy_alert._trace.mark('mail_search', searched)
+                strategy_alert._trace.mark('mail_fetch', fetched)
+                strategy_alert._trace.mark('alert_parse', parsed)
+                strategy_alerts.append((strategy_alert, int(uid)))
+            strategy_alerts.sort(key=lambda alert_and_uid: (alert_and_uid[0].time, alert_and_uid[1]))
+            netted_alerts = net_strategy_alerts(
+                [strategy_alert for strategy_alert, uid in strategy_alerts]
+            )
+            ALERTS.inc('netted', len(strategy_alerts) - len(netted_alerts))
+            for strategy_alert in netted_alerts:
+                self.deliver(strategy_name, strategy_alert)
+
+        if seen_uids:
+            self.mail.uid('store', compact_uid_set(seen_uids), '+FLAGS', '(\\Seen)')
+        return len(seen_uids)
+
+def sustain_mail_dispatcher(dispatcher: MailDispatcher) -> None:
+    '''
+    Ingest loop with reconnect
+    IDLE push mode if enabled and supported by server, polling otherwise
+    Every IDLE cycle ends with a poll so nothing announced in between is lost
+    '''
+    while True:
+        try:
+            dispatcher.connect()
+            use_idle = MAIL_INGEST_MODE == 'idle' and dispatcher.supports_idle()
+            dispatcher.poll() # mails received while disconnected
+            while True:
+                if use_idle:
+                    dispatcher.wait_for_mail(MAIL_IDLE_TIMEOUT)
+                else:
+                    time.sleep(MAIL_POLL_INTERVAL)
+                dispatcher.poll()
+        except (imaplib.IMAP4.error, OSError) as e:
+            print(f'mail dispatcher reconnecting: {e}')
+            time.sleep(MAIL_RECONNECT_DELAY)
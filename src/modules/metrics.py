@@ -0,0 +1,275 @@
+'''Counters, latency histograms and per-alert traces of the alert -> order path'''
+
+import re
+import time
+import json
+import math
+import bisect
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+from typing import Optional
+
+METRICS_PREFIX = 'tinkoffbot_'
+
+REGISTRY = {}
+'''All metrics by name, exported together'''
+
+def get_metric_name(name: str) -> str:
+    '''Prometheus name for human readable one'''
+    return METRICS_PREFIX + re.sub(r'[^a-zA-Z0-9_]+', '_', name).strip('_').lower()
+
+class LatencyRecorder:
+    '''Thread-safe window of latency samples in seconds'''
+
+    def __init__(self, name: str, window: int = 10000) -> None:
+        self.name = name
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, seconds: float) -> None:
+        '''Add one sample'''
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, percent: float) -> float:
+        '''Nearest-rank percentile of collected samples, 0 if empty'''
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        rank = max(0, round(percent / 100 * len(ordered)) - 1)
+        return ordered[min(rank, len(ordered) - 1)]
+
+    def summary(self) -> str:
+        '''Human readable p50/p99 line'''
+        return (
+            f'{self.name}: count={len(self.samples)} '
+            f'p50={self.percentile(50):.3f}s p99={self.percentile(99):.3f}s'
+        )
+
+    def prometheus_lines(self) -> list:
+        '''Summary with window quantiles'''
+        metric_name = get_metric_name(self.name) + '_seconds'
+        return [f'# TYPE {metric_name} summary'] + [
+            f'{metric_name}{{quantile="{quantile}"}} {self.percentile(quantile * 100):.6f}'
+            for quantile in (0.5, 0.9, 0.99)
+        ] + [
+            f'{metric_name}_sum {self.total:.6f}',
+            f'{metric_name}_count {self.count}'
+        ]
+
+class Gauge:
+    '''Last set value and maximum seen'''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.value = 0
+        self.max_value = 0
+        REGISTRY[name] = self
+
+    def set(self, value) -> None:
+        '''Replace current value'''
+        self.value = value
+        self.max_value = max(self.max_value, value)
+
+    def add(self, amount) -> None:
+        '''Change current value by amount'''
+        self.set(self.value + amount)
+
+    def summary(self) -> str:
+        '''Human readable current/max line'''
+        return f'{self.name}: now={self.value} max={self.max_value}'
+
+    def prometheus_lines(self) -> list:
+        '''Current value'''
+        metric_name = get_metric_name(self.name)
+        return [f'# TYPE {metric_name} gauge', f'{metric_name} {self.value}']
+
+class Counter:
+    '''Monotonic thread-safe counter with optional label values'''
+
+    def __init__(self, name: str, label: Optional[str] = None) -> None:
+        self.name = name
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, label_value: str = '', amount: int = 1) -> None:
+        '''Add amount to counter of label value'''
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def summary(self) -> str:
+        '''Human readable values line'''
+        return f'{self.name}: ' + ', '.join(
+            f'{label_value or "total"}={value}' for label_value, value in sorted(self.values.items())
+        )
+
+    def prometheus_lines(self) -> list:
+        '''Counter per label value'''
+        metric_name = get_metric_name(self.name) + '_total'
+        return [f'# TYPE {metric_name} counter'] + [
+            f'{metric_name}{{{self.label}="{label_value}"}} {value}' if self.label
+            else f'{metric_name} {value}'
+            for label_value, value in sorted(self.values.items())
+        ]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+'''Histogram bounds in seconds'''
+
+class Histogram:
+    '''Cumulative bucket histogram of seconds by label value'''
+
+    def __init__(self, name: str, label: str, buckets=DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {} # label value -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        '''Add one sample'''
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, seconds)] += 1
+            series[-1] += seconds
+
+    def summary(self) -> str:
+        '''Human readable count and mean per label value'''
+        with self.lock:
+            series_items = sorted((label_value, list(series)) for label_value, series in self.series.items())
+        return f'{self.name}: ' + ', '.join(
+            f'{label_value} n={sum(series[:-1])} mean={series[-1] / max(1, sum(series[:-1])) * 1000:.1f}ms'
+            for label_value, series in series_items
+        )
+
+    def prometheus_lines(self) -> list:
+        '''Buckets, sum and count per label value'''
+        metric_name = get_metric_name(self.name) + '_seconds'
+        lines = [f'# TYPE {metric_name} histogram']
+        with self.lock:
+            series_items = sorted((label_value, list(series)) for label_value, series in self.series.items())
+        for label_value, series in series_items:
+            cumulative = list(itertools.accumulate(series[:-1]))
+            for bound, count in zip(self.buckets + ('+Inf',), cumulative):
+                lines.append(f'{metric_name}_bucket{{{self.label}="{label_value}",le="{bound}"}} {count}')
+            lines.append(f'{metric_name}_sum{{{self.label}="{label_value}"}} {series[-1]:.6f}')
+            lines.append(f'{metric_name}_count{{{self.label}="{label_value}"}} {cumulative[-1]}')
+        return lines
+
+def render_prometheus() -> str:
+    '''All registered metrics in prometheus text format'''
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines += metric.prometheus_lines()
+    return '\n'.join(lines) + '\n'
+
+ALERT_TO_ORDER_LATENCY = LatencyRecorder('alert to order')
+'''
+From ingest start (mail poll or webhook request) to executed order,
+on our monotonic clock, TradingView time has one second resolution
+'''
+
+ORDER_QUEUE_WAIT = LatencyRecorder('order queue wait')
+'''From submit to pickup by order worker'''
+
+ORDER_QUEUE_DEPTH = Gauge('order queue depth')
+'''Jobs waiting for order worker, summed over account lanes'''
+
+STAGE_LATENCY = Histogram('stage', 'stage')
+'''
+Duration of path stages: mail_search, mail_fetch, alert_parse,
+figi_lookup, order_post, notify, notify_send and alert_total
+'''
+
+ALERTS = Counter('alerts', 'outcome')
+'''Alerts by outcome: received, broken, netted, executed, skipped, failed'''
+
+TELEGRAM_MESSAGES = Counter('telegram messages', 'outcome')
+'''
+Notifier messages by outcome: sent, dropped (queue full), delayed (sent late),
+failed (send error), batches (telegram messages they were coalesced into)
+'''
+
+class AlertTrace:
+    '''
+    Monotonic timestamps of one alert through the stages,
+    correlated with tinkoff tracking ids of its requests
+    '''
+    ids = itertools.count(1)
+
+    def __init__(self, strategy_name: str, source: str, started_at: Optional[float] = None) -> None:
+        self.trace_id = next(self.ids)
+        self.strategy_name = strategy_name
+        self.source = source
+        self.started_at = started_at or time.monotonic()
+        self.marks = []
+        self.tracking_ids = []
+        self.expected_price = math.nan
+        self.outcome = None
+
+    def mark(self, event: str, at: Optional[float] = None) -> None:
+        '''Record event time'''
+        self.marks.append((event, at or time.monotonic()))
+
+    def finish(self, outcome: str) -> None:
+        '''Close trace and keep it among recent ones'''
+        self.outcome = outcome
+        STAGE_LATENCY.observe('alert_total', time.monotonic() - self.started_at)
+        ALERTS.inc(outcome)
+        TRACES.append(self)
+
+    def as_dict(self) -> dict:
+        '''Json friendly, marks are milliseconds since trace start'''
+        return {
+            'trace_id': self.trace_id,
+            'strategy': self.strategy_name,
+            'source': self.source,
+            'outcome': self.outcome,
+            'tracking_ids': self.tracking_ids,
+            'expected_price': None if math.isnan(self.expected_price) else self.expected_price,
+            'marks': {
+                event: round((at - self.started_at) * 1000, 3) for event, at in self.marks
+            }
+        }
+
+TRACES = deque(maxlen=1000)
+'''Recently finished alert traces'''
+
+CURRENT_TRACE = contextvars.ContextVar('CURRENT_TRACE', default=None)
+'''Trace of alert being executed, copied into api threads'''
+
+@contextmanager
+def timed_stage(stage: str):
+    '''Observe stage duration and mark it on current trace'''
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        finished = time.monotonic()
+        STAGE_LATENCY.observe(stage, finished - started)
+        trace = CURRENT_TRACE.get()
+        if trace is not None:
+            trace.mark(stage, finished)
+
+def dump_traces(path: str) -> int:
+    '''Append and forget finished traces as json lines, returns amount'''
+    traces = []
+    while TRACES:
+        traces.append(TRACES.popleft())
+    if traces:
+        with open(path, 'a', encoding='utf-8') as traces_file:
+            traces_file.writelines(json.dumps(trace.as_dict()) + '\n' for trace in traces)
+    return len(traces)
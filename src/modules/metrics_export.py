@@ -0,0 +1,51 @@
+'''Prometheus text endpoint and local file export of metrics and traces'''
+
+import os
+import json
+from tornado.web import (
+    Application,
+    RequestHandler
+)
+from tornado.httpserver import HTTPServer
+from .metrics import (
+    TRACES,
+    render_prometheus,
+    dump_traces
+)
+
+
+class MetricsHandler(RequestHandler):
+    '''GET /metrics in prometheus text format'''
+
+    def get(self) -> None:
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.finish(render_prometheus())
+
+class TracesHandler(RequestHandler):
+    '''GET /traces, recent alert traces not yet dumped to file'''
+
+    def get(self) -> None:
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps([trace.as_dict() for trace in list(TRACES)]))
+
+def start_metrics_server(port: int, address: str) -> HTTPServer:
+    '''Listen on running event loop'''
+    application = Application([
+        (r'/metrics', MetricsHandler),
+        (r'/traces', TracesHandler)
+    ])
+    return application.listen(port, address)
+
+def write_metrics_file(path: str) -> None:
+    '''Atomically replace file with current prometheus text'''
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as metrics_file:
+        metrics_file.write(render_prometheus())
+    os.replace(temporary_path, path)
+
+def export_metrics_files(metrics_path, traces_path) -> None:
+    '''Write metrics snapshot and append finished traces, both optional'''
+    if metrics_path:
+        write_metrics_file(metrics_path)
+    if traces_path:
+        dump_traces(traces_path)
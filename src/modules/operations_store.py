@@ -0,0 +1,199 @@
+'''Incremental operations history sync into local sqlite database'''
+
+import sqlite3
+import threading
+from typing import Iterator, Optional
+from decimal import Decimal
+from datetime import datetime, timedelta, timezone
+from ..settings import (
+    OPERATIONS_DB_PATH,
+    OPERATIONS_HISTORY_START,
+    OPERATIONS_SYNC_WINDOW_DAYS,
+    OPERATIONS_SYNC_OVERLAP_DAYS
+)
+from .tinkoff_api import get_operations
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS operations (
+    broker_id TEXT NOT NULL,
+    operation_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    figi TEXT,
+    operation_type TEXT,
+    status TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    payment TEXT NOT NULL,
+    price TEXT,
+    quantity INTEGER,
+    quantity_executed INTEGER,
+    commission TEXT,
+    commission_currency TEXT,
+    PRIMARY KEY (broker_id, operation_id)
+);
+CREATE INDEX IF NOT EXISTS operations_by_figi ON operations (broker_id, figi, date);
+CREATE TABLE IF NOT EXISTS sync_state (
+    broker_id TEXT PRIMARY KEY,
+    synced_to TEXT NOT NULL
+);
+'''
+
+
+def iterate_date_windows(
+    from_date: datetime,
+    to_date: datetime,
+    window: timedelta
+) -> Iterator[tuple]:
+    '''Consecutive (start, end) windows covering the range'''
+    window_start = from_date
+    while window_start < to_date:
+        window_end = min(window_start + window, to_date)
+        yield window_start, window_end
+        window_start = window_end
+
+def iterate_operations(
+    from_date: datetime,
+    to_date: datetime,
+    window_days: int = OPERATIONS_SYNC_WINDOW_DAYS,
+    figi: Optional[str] = None,
+    broker_id: Optional[str] = None
+) -> Iterator[tuple]:
+    '''
+    Operations of date range fetched window by window (blocking)
+    Yields (window end, operation), only one window is held in memory
+    '''
+    for window_start, window_end in iterate_date_windows(
+        from_date,
+        to_date,
+        timedelta(days=window_days)
+    ):
+        for operation in get_operations(
+            window_start.isoformat(),
+            window_end.isoformat(),
+            figi,
+            broker_id
+        ):
+            yield window_end, operation
+        yield window_end, None # window completed, even if empty
+
+class OperationsStore:
+    '''
+    Operations by broker account in sqlite
+    Sync fetches only the tail after last synced window, overlapping
+    it a bit so operations still in progress get their final state
+    '''
+
+    def __init__(self, path: str = OPERATIONS_DB_PATH) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def get_synced_to(self, broker_id: Optional[str] = None) -> Optional[datetime]:
+        '''End of last fully stored window'''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT synced_to FROM sync_state WHERE broker_id = ?',
+                (broker_id or '',)
+            ).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def store_operations(
+        self,
+        broker_id: Optional[str],
+        operations: list,
+        synced_to: datetime
+    ) -> None:
+        '''Upsert operations and move sync mark in one transaction'''
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO operations VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (
+                        broker_id or '',
+                        operation.operation_id,
+                        operation.date,
+                        operation.figi,
+                        operation.operation_type,
+                        operation.status,
+                        operation.currency,
+                        str(operation.payment),
+                        None if operation.price is None else str(operation.price),
+                        operation.quantity,
+                        operation.quantity_executed,
+                        None if operation.commission is None else str(operation.commission.value),
+                        None if operation.commission is None else operation.commission.currency
+                    ) for operation in operations
+                ]
+            )
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sync_state VALUES (?, ?)',
+                (broker_id or '', synced_to.isoformat())
+            )
+
+    def sync(
+        self,
+        broker_id: Optional[str] = None,
+        to_date: Optional[datetime] = None
+    ) -> int:
+        '''
+        Fetch new operations up to to_date (now by default), blocking
+        Every window is committed separately, so interrupted sync
+        continues from the last stored window
+        Returns amount of stored operations
+        '''
+        to_date = to_date or datetime.now(timezone.utc)
+        synced_to = self.get_synced_to(broker_id)
+        if synced_to is None:
+            from_date = datetime.fromisoformat(OPERATIONS_HISTORY_START)
+        else:
+            from_date = synced_to - timedelta(days=OPERATIONS_SYNC_OVERLAP_DAYS)
+
+        stored = 0
+        window_operations = []
+        for window_end, operation in iterate_operations(
+            from_date,
+            to_date,
+            broker_id=broker_id
+        ):
+            if operation is not None:
+                window_operations.append(operation)
+                continue
+            self.store_operations(broker_id, window_operations, window_end)
+            stored += len(window_operations)
+            window_operations = []
+        return stored
+
+    def iterate_stored(
+        self,
+        broker_id: Optional[str] = None,
+        figi: Optional[str] = None
+    ) -> Iterator[tuple]:
+        '''Stored operations rows ordered by date, read lazily'''
+        query = 'SELECT * FROM operations WHERE broker_id = ?'
+        params = [broker_id or '']
+        if figi:
+            query += ' AND figi = ?'
+            params.append(figi)
+        connection = sqlite3.connect(self.path)
+        try:
+            yield from connection.execute(query + ' ORDER BY date', params)
+        finally:
+            connection.close()
+
+    def get_payment_totals(self, broker_id: Optional[str] = None) -> dict:
+        '''
+        Sums of done payments and commissions by (figi, currency) for P&L,
+        decimal arithmetic over lazily read rows
+        '''
+        totals = {}
+        for row in self.iterate_stored(broker_id):
+            figi, status, currency, payment, commission = row[3], row[5], row[6], row[7], row[11]
+            if status != 'Done':
+                continue
+            payment_total, commission_total = totals.get((figi, currency), (Decimal(0), Decimal(0)))
+            totals[(figi, currency)] = (
+                payment_total + Decimal(payment),
+                commission_total + Decimal(commission or 0)
+            )
+        return totals
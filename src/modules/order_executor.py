@@ -0,0 +1,104 @@
+'''Bounded order queue and worker pool between alerts and tinkoff'''
+
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Optional
+from ..settings import (
+    ORDER_WORKERS,
+    ORDER_QUEUE_SIZE
+)
+from .metrics import (
+    ORDER_QUEUE_WAIT,
+    ORDER_QUEUE_DEPTH
+)
+
+
+class OrderJob:
+    '''One alert waiting for execution'''
+
+    def __init__(
+        self,
+        strategy_name: str,
+        strategy_alert,
+        figi: str,
+        broker_id: Optional[str] = None
+    ) -> None:
+        self.strategy_name = strategy_name
+        self.strategy_alert = strategy_alert
+        self.figi = figi
+        self.broker_id = broker_id
+        self.enqueued_at = time.monotonic()
+        self.done = asyncio.get_running_loop().create_future()
+
+    @property
+    def key(self) -> tuple:
+        '''Orders with same key are executed strictly one by one'''
+        return (self.broker_id, self.figi)
+
+class OrderExecutor:
+    '''
+    Bounded pool of waiting jobs feeding worker tasks
+    Jobs wait in FIFO queue of their account and figi, a worker
+    takes only keys nobody is running, so orders for the same key
+    are serialized and a burst of one key never parks other workers
+    '''
+
+    def __init__(
+        self,
+        handle: Callable,
+        workers: int = ORDER_WORKERS,
+        queue_size: int = ORDER_QUEUE_SIZE
+    ) -> None:
+        self.handle = handle
+        self.workers = workers
+        self.slots = asyncio.Semaphore(queue_size)
+        self.waiting = 0
+        self.key_jobs = {} # running or ready key -> its waiting jobs
+        self.ready_keys = asyncio.Queue()
+
+    async def submit(self, job: OrderJob) -> asyncio.Future:
+        '''Enqueue job, waits only if queue is full, returns job.done'''
+        await self.slots.acquire()
+        jobs = self.key_jobs.get(job.key)
+        if jobs is None:
+            self.key_jobs[job.key] = deque((job,))
+            self.ready_keys.put_nowait(job.key)
+        else: # key is ready or running, its worker picks job up later
+            jobs.append(job)
+        self.waiting += 1
+        ORDER_QUEUE_DEPTH.add(1)
+        return job.done
+
+    def take_job(self, key: tuple) -> OrderJob:
+        '''Oldest job of ready key, frees its queue slot'''
+        job = self.key_jobs[key].popleft()
+        self.waiting -= 1
+        self.slots.release()
+        ORDER_QUEUE_DEPTH.add(-1)
+        ORDER_QUEUE_WAIT.observe(time.monotonic() - job.enqueued_at)
+        return job
+
+    def release_key(self, key: tuple) -> None:
+        '''Key goes back behind other ready keys if it has more jobs'''
+        if self.key_jobs[key]:
+            self.ready_keys.put_nowait(key)
+        else:
+            del self.key_jobs[key]
+
+    async def sustain_worker(self) -> None:
+        '''
+        Take jobs forever, result or exception goes to job.done,
+        run workers amount of them under supervisor
+        '''
+        while True:
+            key = await self.ready_keys.get()
+            job = self.take_job(key)
+            try:
+                result = await self.handle(job)
+            except Exception as e:
+                job.done.set_exception(e)
+            else:
+                job.done.set_result(result)
+            finally:
+                self.release_key(key)
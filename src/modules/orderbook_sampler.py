@@ -0,0 +1,139 @@
+'''Latest orderbooks of traded figis as numpy arrays with fill estimates'''
+
+import math
+import time
+from typing import Optional
+import numpy as np
+from ..settings import (
+    ORDERBOOK_DEPTH,
+    ORDERBOOK_MAX_AGE
+)
+from .tinkoff_api import get_orderbook
+
+
+class OrderbookSnapshot:
+    '''
+    Fixed-size price and quantity arrays of one orderbook
+    Levels beyond actual depth have nan price and zero quantity
+    '''
+    __slots__ = (
+        'figi',
+        'bid_prices',
+        'bid_quantities',
+        'ask_prices',
+        'ask_quantities',
+        'sampled_at'
+    )
+
+    def __init__(self, figi: str, depth: int = ORDERBOOK_DEPTH) -> None:
+        self.figi = figi
+        self.bid_prices = np.full(depth, np.nan)
+        self.bid_quantities = np.zeros(depth, dtype=np.int64)
+        self.ask_prices = np.full(depth, np.nan)
+        self.ask_quantities = np.zeros(depth, dtype=np.int64)
+        self.sampled_at = 0.0
+
+    def fill_side(self, prices: np.ndarray, quantities: np.ndarray, side) -> None:
+        '''Copy orderbook side into arrays, array-backed sides without boxing'''
+        levels = min(len(side), len(prices))
+        if hasattr(side, 'prices'): # fast decoded side
+            prices[:levels] = np.frombuffer(side.prices, dtype=np.float64, count=levels)
+            quantities[:levels] = np.frombuffer(side.quantities, dtype=np.int64, count=levels)
+        else:
+            for level, order in zip(range(levels), side):
+                prices[level] = order.price
+                quantities[level] = order.quantity
+
+    def update(self, orderbook) -> None:
+        '''Fill levels from fresh orderbook'''
+        self.fill_side(self.bid_prices, self.bid_quantities, orderbook.bids)
+        self.fill_side(self.ask_prices, self.ask_quantities, orderbook.asks)
+        self.sampled_at = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        '''Seconds since last update'''
+        return time.monotonic() - self.sampled_at
+
+def get_spread(snapshot: OrderbookSnapshot) -> float:
+    '''Best ask minus best bid, nan if a side is empty'''
+    return float(snapshot.ask_prices[0] - snapshot.bid_prices[0])
+
+def get_weighted_mid(snapshot: OrderbookSnapshot, levels: Optional[int] = None) -> float:
+    '''Mean of quantity-weighted bid and ask prices over top levels'''
+    levels = levels or len(snapshot.bid_prices)
+    weighted_prices = []
+    for prices, quantities in (
+        (snapshot.bid_prices[:levels], snapshot.bid_quantities[:levels]),
+        (snapshot.ask_prices[:levels], snapshot.ask_quantities[:levels])
+    ):
+        total_quantity = quantities.sum()
+        if not total_quantity:
+            return math.nan
+        weighted_prices.append(np.nansum(prices * quantities) / total_quantity)
+    return float((weighted_prices[0] + weighted_prices[1]) / 2)
+
+def estimate_fill_price(snapshot: OrderbookSnapshot, operation: str, lots: int) -> float:
+    '''
+    Average price of market order walking the book
+    Buy takes asks, Sell takes bids, nan if book is thinner than lots
+    '''
+    if operation == 'Buy':
+        prices, quantities = snapshot.ask_prices, snapshot.ask_quantities
+    else:
+        prices, quantities = snapshot.bid_prices, snapshot.bid_quantities
+    if lots <= 0 or quantities.sum() < lots:
+        return math.nan
+    taken_before = np.cumsum(quantities) - quantities
+    taken = np.clip(lots - taken_before, 0, quantities)
+    return float(np.nansum(prices * taken) / lots)
+
+class OrderbookSampler:
+    '''
+    Snapshots by figi refreshed by background task,
+    readers get the last sample without any request
+    '''
+
+    def __init__(self, depth: int = ORDERBOOK_DEPTH) -> None:
+        self.depth = depth
+        self.figis = []
+        self.snapshots = {}
+
+    def track(self, figis) -> None:
+        '''Add figis to sampling'''
+        for figi in figis:
+            if figi not in self.figis:
+                self.figis.append(figi)
+
+    def untrack(self, figis) -> None:
+        '''Stop sampling figis and forget their snapshots'''
+        for figi in figis:
+            if figi in self.figis:
+                self.figis.remove(figi)
+            self.snapshots.pop(figi, None)
+
+    def sample(self, figi: str) -> None:
+        '''
+        Fetch one orderbook (blocking), snapshot is replaced as a whole
+        so readers never see half updated arrays
+        '''
+        snapshot = OrderbookSnapshot(figi, self.depth)
+        snapshot.update(get_orderbook(figi, self.depth, fast=True))
+        self.snapshots[figi] = snapshot
+
+    def get(self, figi: str, max_age: float = ORDERBOOK_MAX_AGE) -> Optional[OrderbookSnapshot]:
+        '''Snapshot if sampled recently enough'''
+        snapshot = self.snapshots.get(figi)
+        if snapshot is None or snapshot.age > max_age:
+            return None
+        return snapshot
+
+    def estimate_fill_price(self, figi: str, operation: str, lots: int) -> float:
+        '''Expected market order price from last sample, nan if unknown'''
+        snapshot = self.get(figi)
+        if snapshot is None:
+            return math.nan
+        return estimate_fill_price(snapshot, operation, lots)
+
+ORDERBOOKS = OrderbookSampler()
+'''Shared orderbook samples of traded figis'''
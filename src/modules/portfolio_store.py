@@ -0,0 +1,152 @@
+'''In-memory positions per broker account reconciled with tinkoff portfolio'''
+
+import threading
+from typing import Optional, Union
+from decimal import Decimal
+from .tinkoff_classes import (
+    PlacedLimitOrder,
+    PlacedMarketOrder
+)
+from .tinkoff_api import (
+    get_portfolio,
+    get_portfolio_currencies
+)
+
+
+def signed_order_lots(placed_order: Union[PlacedMarketOrder, PlacedLimitOrder]) -> int:
+    '''
+    Lots the order changes position by, negative for sell
+    Market orders are expected to fill completely,
+    limit orders count only already executed lots
+    '''
+    if placed_order.status in ('Rejected', 'Cancelled'):
+        return 0
+    if isinstance(placed_order, PlacedMarketOrder):
+        lots = placed_order.requested_lots or placed_order.executed_lots or 0
+    else:
+        lots = placed_order.executed_lots or 0
+    return -lots if placed_order.operation == 'Sell' else lots
+
+class PositionStore:
+    '''
+    Lots by figi and currency balances of one broker account
+    Orders are applied optimistically, reconcile replaces state
+    with /portfolio and returns what did not match
+    '''
+
+    def __init__(self, broker_id: Optional[str] = None) -> None:
+        self.broker_id = broker_id
+        self.lots = {}
+        self.currencies = {}
+        self.touched_while_reconciling = None
+        self.reconciled = False
+        self.lock = threading.Lock()
+
+    def get_lots(self, figi: str) -> int:
+        '''Current lots of figi, 0 if no position'''
+        return self.lots.get(figi, 0)
+
+    def get_currency(self, currency: str) -> Decimal:
+        '''Currency balance as of last reconcile'''
+        return self.currencies.get(currency, Decimal(0))
+
+    def apply_lots(self, figi: str, lots: int) -> None:
+        '''Shift position of figi by signed lots'''
+        if not lots:
+            return
+        with self.lock:
+            self.lots[figi] = self.lots.get(figi, 0) + lots
+            if not self.lots[figi]:
+                del self.lots[figi]
+            if self.touched_while_reconciling is not None:
+                self.touched_while_reconciling.add(figi)
+
+    def apply_order(
+        self,
+        figi: str,
+        placed_order: Union[PlacedMarketOrder, PlacedLimitOrder]
+    ) -> int:
+        '''Optimistic update from order result, returns applied lots'''
+        lots = signed_order_lots(placed_order)
+        self.apply_lots(figi, lots)
+        return lots
+
+    def reconcile(self) -> list:
+        '''
+        Replace state with api portfolio (blocking, two requests)
+        Returns divergences as list of (figi, expected lots, actual lots)
+        Figis traded while requests were in flight keep local lots
+        and are checked on the next reconcile
+        '''
+        with self.lock:
+            self.touched_while_reconciling = set()
+        try:
+            positions = get_portfolio(self.broker_id)
+            currencies = get_portfolio_currencies(self.broker_id)
+        except BaseException:
+            with self.lock:
+                self.touched_while_reconciling = None
+            raise
+
+        actual_lots = {position.figi: position.lots for position in positions if position.lots}
+        with self.lock:
+            touched = self.touched_while_reconciling
+            self.touched_while_reconciling = None
+            divergences = []
+            if self.reconciled:
+                divergences = [
+                    (figi, self.lots.get(figi, 0), actual_lots.get(figi, 0))
+                    for figi in sorted(set(self.lots) | set(actual_lots))
+                    if figi not in touched and self.lots.get(figi, 0) != actual_lots.get(figi, 0)
+                ]
+            for figi in touched:
+                if figi in self.lots:
+                    actual_lots[figi] = self.lots[figi]
+                else:
+                    actual_lots.pop(figi, None)
+            self.lots = actual_lots
+            self.currencies = {
+                currency_position.currency: currency_position.balance
+                for currency_position in currencies
+            }
+            self.reconciled = True
+        return divergences
+
+class PortfolioStore:
+    '''
+    Position stores by broker account, created on first use
+    by position_store factory, shard processes swap it for remote stores
+    '''
+
+    def __init__(self) -> None:
+        self.accounts = {}
+        self.position_store = PositionStore
+        self.lock = threading.Lock()
+
+    def get(self, broker_id: Optional[str] = None) -> PositionStore:
+        '''Store of the account, None is default account'''
+        store = self.accounts.get(broker_id)
+        if store is None:
+            with self.lock:
+                store = self.accounts.setdefault(broker_id, self.position_store(broker_id))
+        return store
+
+    def reconcile(self) -> dict:
+        '''Reconcile every known account, returns divergences by broker id'''
+        return {
+            broker_id: store.reconcile()
+            for broker_id, store in list(self.accounts.items())
+        }
+
+    def summary(self) -> str:
+        '''Human readable positions of all accounts'''
+        return '\n'.join(
+            f'{broker_id or "default"}: ' + (
+                ', '.join(f'{figi}={lots}' for figi, lots in sorted(store.lots.items()))
+                or 'no positions'
+            )
+            for broker_id, store in list(self.accounts.items())
+        )
+
+PORTFOLIO = PortfolioStore()
+'''Shared positions of all accounts'''
@@ -0,0 +1,84 @@
+'''Token bucket scheduler for tinkoff api request quotas'''
+
+import heapq
+import itertools
+import threading
+import time
+from ..settings import TINKOFF_RATE_LIMITS
+from .metrics import LatencyRecorder
+
+ORDER_PRIORITY = 0
+'''Order placement and cancel, always served first'''
+
+READ_PRIORITY = 1
+'''Informational reads'''
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket refilled continuously
+    Waiting callers are served by priority, then by arrival
+    '''
+
+    def __init__(self, name: str, requests_per_minute: float) -> None:
+        self.name = name
+        self.rate = requests_per_minute / 60
+        self.capacity = requests_per_minute / 60 * 10 # up to 10 seconds burst
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.waiters = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.wait_latency = LatencyRecorder(f'throttle {name}')
+
+    def refill(self) -> None:
+        '''Add tokens for elapsed time'''
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, priority: int = READ_PRIORITY) -> float:
+        '''Block until request is allowed, returns waited seconds'''
+        started = time.monotonic()
+        ticket = (priority, next(self.counter))
+        with self.condition:
+            heapq.heappush(self.waiters, ticket)
+            while True:
+                self.refill()
+                if self.waiters[0] == ticket and self.tokens >= 1:
+                    heapq.heappop(self.waiters)
+                    self.tokens -= 1
+                    self.condition.notify_all() # next in line may go
+                    break
+                timeout = None
+                if self.waiters[0] == ticket:
+                    timeout = (1 - self.tokens) / self.rate
+                self.condition.wait(timeout)
+        waited = time.monotonic() - started
+        self.wait_latency.observe(waited)
+        return waited
+
+class RateLimiter:
+    '''Bucket per endpoint group: orders, market, portfolio, operations, user'''
+
+    def __init__(self, limits: dict = TINKOFF_RATE_LIMITS) -> None:
+        self.buckets = {
+            group: TokenBucket(group, requests_per_minute)
+            for group, requests_per_minute in limits.items()
+        }
+
+    def acquire(self, endpoint: str, priority: int = READ_PRIORITY) -> float:
+        '''Wait for quota of endpoint group, unknown groups are not limited'''
+        bucket = self.buckets.get(endpoint.strip('/').split('/')[0])
+        if bucket is None:
+            return 0.0
+        return bucket.acquire(priority)
+
+    def summary(self) -> str:
+        '''Throttle waits of all groups'''
+        return '\n'.join(
+            bucket.wait_latency.summary() for bucket in self.buckets.values()
+        )
+
+RATE_LIMITER = RateLimiter()
+'''Shared by all api calls in process'''
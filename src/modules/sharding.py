@@ -0,0 +1,254 @@
+'''
+Strategies split across shard processes, account-level state
+(positions, rate limits, notifications) kept by coordinator process
+and reached over a pipe
+'''
+
+import os
+import time
+import asyncio
+import itertools
+import threading
+import multiprocessing
+from typing import Callable, Optional
+from multiprocessing.connection import Connection
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor
+)
+from .metrics import LatencyRecorder
+from .rate_limiter import RATE_LIMITER
+from .portfolio_store import (
+    PORTFOLIO,
+    signed_order_lots
+)
+
+COORDINATOR_CALL = LatencyRecorder('coordinator call')
+'''Round trip of blocking shard to coordinator call'''
+
+BLOCKING_METHODS = {'acquire', 'flush'}
+'''Served by coordinator thread pool, the rest inline in request order'''
+
+
+def split_strategies(strategies: dict, shards: int) -> list:
+    '''
+    Round robin over sorted strategy names, the same
+    strategies always land in the same shard, empty shards are skipped
+    '''
+    shard_strategies = [{} for _ in range(shards)]
+    for number, strategy_name in enumerate(sorted(strategies)):
+        shard_strategies[number % shards][strategy_name] = strategies[strategy_name]
+    return [strategies for strategies in shard_strategies if strategies]
+
+def get_shard_port(port: Optional[int], shard_number: int) -> Optional[int]:
+    '''Listening port of shard, base port plus shard number'''
+    return port + shard_number if port else port
+
+def get_shard_path(path: Optional[str], shard_number: Optional[int]) -> Optional[str]:
+    '''Output file of shard process, coordinator keeps path as is'''
+    if not path or shard_number is None:
+        return path
+    return f'{path}.shard{shard_number}'
+
+class CoordinatorClient:
+    '''
+    Shard side of the pipe, thread-safe
+    Calls wait for result, sends are fire and forget,
+    both keep order of one connection
+    '''
+
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.call_ids = itertools.count(1)
+        self.calls = {}
+        self.thread = threading.Thread(target=self.sustain_reading, daemon=True)
+        self.thread.name = 'thread coordinator client'
+        self.thread.start()
+
+    def call(self, method: str, *args):
+        '''Blocking call of coordinator method'''
+        started = time.monotonic()
+        future = Future()
+        with self.lock:
+            call_id = next(self.call_ids)
+            self.calls[call_id] = future
+            self.connection.send((call_id, method, args))
+        result = future.result()
+        COORDINATOR_CALL.observe(time.monotonic() - started)
+        return result
+
+    def send(self, method: str, *args) -> None:
+        '''Call without waiting for result'''
+        with self.lock:
+            self.connection.send((None, method, args))
+
+    def sustain_reading(self) -> None:
+        '''Resolve calls by id, shard cannot trade without coordinator'''
+        try:
+            while True:
+                call_id, result, error = self.connection.recv()
+                future = self.calls.pop(call_id)
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(f'coordinator: {error}'))
+        except (EOFError, OSError):
+            print('coordinator is gone, shard exits')
+            os._exit(1)
+
+    def send_message(self, chat_id, text, **kwargs) -> None:
+        '''Notifier interface, message goes to coordinator notifier'''
+        self.send('send_message', chat_id, str(text), kwargs)
+
+    def flush(self, timeout: float) -> bool:
+        '''Wait for coordinator notifier'''
+        return self.call('flush', timeout)
+
+    def summary(self) -> str:
+        '''Human readable call latency'''
+        return COORDINATOR_CALL.summary()
+
+class RemoteBucket:
+    '''Token bucket of coordinator, same interface as TokenBucket'''
+
+    def __init__(self, client: CoordinatorClient, group: str) -> None:
+        self.client = client
+        self.group = group
+        self.wait_latency = LatencyRecorder(f'throttle {group}')
+
+    def acquire(self, priority: int) -> float:
+        '''Wait until coordinator grants a token, returns seconds waited'''
+        waited = self.client.call('acquire', self.group, priority)
+        self.wait_latency.observe(waited)
+        return waited
+
+class RemotePositionStore:
+    '''Position store of coordinator, trading subset of PositionStore'''
+
+    def __init__(self, client: CoordinatorClient, broker_id: Optional[str] = None) -> None:
+        self.client = client
+        self.broker_id = broker_id
+        self.lots = {} # positions are summarized by coordinator
+
+    def get_lots(self, figi: str) -> int:
+        '''Current lots of figi in coordinator'''
+        return self.client.call('get_lots', self.broker_id, figi)
+
+    def apply_lots(self, figi: str, lots: int) -> None:
+        '''Shift coordinator position, ordered before later get_lots'''
+        if lots:
+            self.client.send('apply_lots', self.broker_id, figi, lots)
+
+    def apply_order(self, figi: str, placed_order) -> int:
+        '''Optimistic update from order result, returns applied lots'''
+        lots = signed_order_lots(placed_order)
+        self.apply_lots(figi, lots)
+        return lots
+
+def connect_coordinator(connection: Connection) -> CoordinatorClient:
+    '''Point rate limiter and portfolio of shard process to coordinator'''
+    client = CoordinatorClient(connection)
+    RATE_LIMITER.buckets = {
+        group: RemoteBucket(client, group) for group in RATE_LIMITER.buckets
+    }
+    PORTFOLIO.position_store = lambda broker_id: RemotePositionStore(client, broker_id)
+    return client
+
+class Coordinator:
+    '''
+    Serves shard processes: rate limiter buckets, position stores
+    and notifier of this process
+    One reader thread per shard, blocking methods go to thread pool
+    '''
+
+    def __init__(self, notifier, pool_size: int = 32) -> None:
+        self.notifier = notifier
+        self.executor = ThreadPoolExecutor(pool_size, 'thread coordinator')
+        self.methods = {
+            'acquire': self.acquire,
+            'flush': notifier.flush,
+            'send_message': lambda chat_id, text, kwargs: notifier.send_message(chat_id, text, **kwargs),
+            'get_lots': lambda broker_id, figi: PORTFOLIO.get(broker_id).get_lots(figi),
+            'apply_lots': lambda broker_id, figi, lots: PORTFOLIO.get(broker_id).apply_lots(figi, lots)
+        }
+
+    def acquire(self, group: str, priority: int) -> float:
+        '''Token of local bucket, blocking'''
+        bucket = RATE_LIMITER.buckets.get(group)
+        return bucket.acquire(priority) if bucket else 0.0
+
+    def serve_call(self, connection: Connection, lock: threading.Lock, request: tuple) -> None:
+        '''Run method, answer calls'''
+        call_id, method, args = request
+        result, error = None, None
+        try:
+            result = self.methods[method](*args)
+        except Exception as e:
+            error = repr(e)
+        if call_id is not None:
+            with lock:
+                connection.send((call_id, result, error))
+
+    def sustain_serving(self, connection: Connection) -> None:
+        '''Read requests of one shard until its process ends'''
+        lock = threading.Lock()
+        try:
+            while True:
+                request = connection.recv()
+                if request[1] in BLOCKING_METHODS:
+                    self.executor.submit(self.serve_call, connection, lock, request)
+                else:
+                    self.serve_call(connection, lock, request)
+        except (EOFError, OSError):
+            connection.close()
+
+    def start_shard(self, target: Callable, shard_number: int, strategies: dict):
+        '''Spawn shard process target(shard_number, strategies, connection)'''
+        context = multiprocessing.get_context('spawn') # no inherited threads and locks
+        connection, shard_connection = context.Pipe()
+        process = context.Process(
+            target=target,
+            args=(shard_number, strategies, shard_connection),
+            name=f'shard {shard_number}',
+            daemon=True
+        )
+        process.start()
+        shard_connection.close()
+        thread = threading.Thread(
+            target=self.sustain_serving,
+            args=(connection,),
+            daemon=True
+        )
+        thread.name = f'thread coordinator shard {shard_number}'
+        thread.start()
+        return process
+
+    async def sustain_shard(
+        self,
+        target: Callable,
+        shard_number: int,
+        strategies: dict,
+        state: dict
+    ) -> None:
+        '''
+        Run shard process until it exits, end is noticed through
+        process sentinel on event loop, cancelling terminates process
+        Supervisor worker, state keeps pid of current process
+        '''
+        loop = asyncio.get_running_loop()
+        process = self.start_shard(target, shard_number, strategies)
+        state['pid'] = process.pid
+        ended = loop.create_future()
+        loop.add_reader(
+            process.sentinel,
+            lambda: ended.done() or ended.set_result(None)
+        )
+        try:
+            await ended
+        finally:
+            loop.remove_reader(process.sentinel)
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        raise ChildProcessError(f'shard {shard_number} exited with code {process.exitcode}')
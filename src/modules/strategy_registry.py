@@ -0,0 +1,224 @@
+'''Live strategies, changed by strategies file or telegram without restart'''
+
+import os
+import json
+import asyncio
+from typing import Callable, Optional
+from ..settings import (
+    STRATEGIES,
+    STRATEGY_ACCOUNTS,
+    STRATEGIES_FILE,
+    STRATEGIES_FILE_INTERVAL
+)
+
+
+def parse_strategies(config: dict) -> tuple:
+    '''
+    (strategies, accounts) from {name: ticker}
+    or {name: {"ticker": ticker, "account": account}}
+    '''
+    strategies, accounts = {}, {}
+    for strategy_name, strategy in config.items():
+        if isinstance(strategy, str):
+            strategies[strategy_name] = strategy
+        elif isinstance(strategy, dict) and isinstance(strategy.get('ticker'), str):
+            strategies[strategy_name] = strategy['ticker']
+            if strategy.get('account'):
+                accounts[strategy_name] = strategy['account']
+        else:
+            raise ValueError(f'strategy {strategy_name}: expected ticker or {{"ticker", "account"}}')
+    return strategies, accounts
+
+def load_strategies_file(path: str) -> tuple:
+    '''(strategies, accounts) from json file'''
+    with open(path, encoding='utf-8') as strategies_file:
+        config = json.load(strategies_file)
+    if not isinstance(config, dict):
+        raise ValueError('strategies file must be json object')
+    return parse_strategies(config)
+
+def save_strategies_file(path: str, strategies: dict, accounts: dict) -> None:
+    '''Atomically replace file, plain ticker for default account strategies'''
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as strategies_file:
+        json.dump(
+            {
+                strategy_name: {'ticker': ticker, 'account': accounts[strategy_name]}
+                if strategy_name in accounts else ticker
+                for strategy_name, ticker in sorted(strategies.items())
+            },
+            strategies_file,
+            indent=2
+        )
+    os.replace(temporary_path, path)
+
+def diff_strategies(
+    strategies: dict,
+    accounts: dict,
+    new_strategies: dict,
+    new_accounts: dict
+) -> tuple:
+    '''
+    (added, removed) where added is {name: ticker} and removed is list of names,
+    strategy with changed ticker or account is both removed and added
+    '''
+    removed = [
+        strategy_name for strategy_name in strategies
+        if strategies[strategy_name] != new_strategies.get(strategy_name)
+        or accounts.get(strategy_name) != new_accounts.get(strategy_name)
+    ]
+    added = {
+        strategy_name: ticker for strategy_name, ticker in new_strategies.items()
+        if strategy_name not in strategies or strategy_name in removed
+    }
+    return added, removed
+
+class StrategyRegistry:
+    '''
+    Current strategies and accounts, dicts are updated in place
+    so webhook and bot see changes at once
+    Changes are applied one at a time on bot event loop by
+    apply(added, added_accounts, removed) coroutine, untouched strategies keep running
+    '''
+
+    def __init__(self) -> None:
+        self.strategies = {}
+        self.accounts = {}
+        self.path = STRATEGIES_FILE
+        self.file_mtime = None
+        self.apply: Optional[Callable] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lock = None
+
+    def get_initial(self) -> tuple:
+        '''Strategies file if it exists, settings otherwise'''
+        if self.path and os.path.exists(self.path):
+            self.file_mtime = os.stat(self.path).st_mtime
+            return load_strategies_file(self.path)
+        return dict(STRATEGIES), dict(STRATEGY_ACCOUNTS)
+
+    async def start(self, apply: Callable, strategies: Optional[dict] = None) -> str:
+        '''
+        Start initial strategies, shard passes its fixed part of them
+        and is not changed later, otherwise registry takes over running loop
+        '''
+        self.apply = apply
+        self.lock = asyncio.Lock()
+        initial_strategies, initial_accounts = self.get_initial()
+        if strategies is None:
+            self.loop = asyncio.get_running_loop()
+        else:
+            initial_strategies = strategies
+            initial_accounts = {
+                strategy_name: account for strategy_name, account in initial_accounts.items()
+                if strategy_name in strategies
+            }
+        return await self.update(initial_strategies, initial_accounts)
+
+    async def update(self, new_strategies: dict, new_accounts: dict) -> str:
+        '''Apply difference to new state, returns human readable change'''
+        async with self.lock:
+            return await self.apply_state(new_strategies, new_accounts)
+
+    async def apply_state(self, new_strategies: dict, new_accounts: dict) -> str:
+        '''Body of update, caller holds the lock'''
+        added, removed = diff_strategies(
+            self.strategies,
+            self.accounts,
+            new_strategies,
+            new_accounts
+        )
+        if not added and not removed:
+            return 'strategies unchanged'
+        await self.apply(
+            {strategy_name: new_strategies[strategy_name] for strategy_name in added},
+            {strategy_name: new_accounts.get(strategy_name) for strategy_name in added},
+            removed
+        )
+        for strategy_name in removed:
+            del self.strategies[strategy_name]
+            self.accounts.pop(strategy_name, None)
+        self.strategies.update(added)
+        self.accounts.update(
+            (strategy_name, new_accounts[strategy_name])
+            for strategy_name in added if strategy_name in new_accounts
+        )
+        return (
+            f'strategies added: {", ".join(added) or "-"}, '
+            f'removed: {", ".join(name for name in removed if name not in added) or "-"}, '
+            f'restarted: {", ".join(name for name in removed if name in added) or "-"}'
+        )
+
+    def load_changed_file(self) -> Optional[tuple]:
+        '''(strategies, accounts) of strategies file modified since last read or write, None otherwise'''
+        try:
+            file_mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+        if file_mtime == self.file_mtime:
+            return None
+        self.file_mtime = file_mtime
+        return load_strategies_file(self.path)
+
+    async def change_strategy(self, strategy_name: str, ticker: Optional[str], account: Optional[str]) -> str:
+        '''
+        Change one strategy on top of current state, edit of strategies file
+        not yet picked up by watcher included, and write result to the file
+        '''
+        async with self.lock:
+            file_state = self.load_changed_file() if self.path else None
+            new_strategies, new_accounts = file_state or (self.strategies, self.accounts)
+            new_strategies, new_accounts = dict(new_strategies), dict(new_accounts)
+            if not ticker and strategy_name not in new_strategies and file_state is None:
+                return f'no strategy {strategy_name}'
+            new_strategies.pop(strategy_name, None)
+            new_accounts.pop(strategy_name, None)
+            if ticker:
+                new_strategies[strategy_name] = ticker
+                if account:
+                    new_accounts[strategy_name] = account
+            result = await self.apply_state(new_strategies, new_accounts)
+            if self.path:
+                save_strategies_file(self.path, self.strategies, self.accounts)
+                self.file_mtime = os.stat(self.path).st_mtime # own write is not a change
+            return result
+
+    def change(self, strategy_name: str, ticker: Optional[str], account: Optional[str] = None) -> str:
+        '''
+        Add, replace or (without ticker) remove one strategy from other thread,
+        blocking, change is written to strategies file if configured
+        '''
+        if self.loop is None:
+            return 'strategies can be changed only when running without shards'
+        try:
+            return asyncio.run_coroutine_threadsafe(
+                self.change_strategy(strategy_name, ticker, account),
+                self.loop
+            ).result(60)
+        except Exception as e: # admin input, unknown ticker or account included
+            return f'strategy {strategy_name} not changed: {e!r}'
+
+    async def sustain_watching(self, notify: Callable) -> None:
+        '''Reload strategies file whenever its modification time changes'''
+        while True:
+            await asyncio.sleep(STRATEGIES_FILE_INTERVAL)
+            try:
+                async with self.lock: # read and apply as one step, telegram change may write file
+                    file_state = self.load_changed_file()
+                    if file_state is None:
+                        continue
+                    result = await self.apply_state(*file_state)
+            except Exception as e: # admin input, json errors included
+                notify(f'strategies file not applied: {e!r}')
+                continue
+            notify(result)
+
+    def summary(self) -> str:
+        '''Human readable strategies with tickers and accounts'''
+        return '\n'.join(
+            f'{strategy_name}: {ticker} on {self.accounts.get(strategy_name) or "default"} account'
+            for strategy_name, ticker in sorted(self.strategies.items())
+        )
+
+STRATEGY_REGISTRY = StrategyRegistry()
+'''Live strategies of the bot'''
@@ -0,0 +1,150 @@
+'''Restart failed worker tasks with exponential backoff'''
+
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Optional
+from ..settings import (
+    SUPERVISOR_BACKOFF,
+    SUPERVISOR_MAX_BACKOFF,
+    SUPERVISOR_STABLE_AFTER,
+    SUPERVISOR_MAX_RESTARTS,
+    SUPERVISOR_RESTART_WINDOW
+)
+from .metrics import Counter
+
+WORKER_RESTARTS = Counter('worker restarts', 'worker')
+'''Restarts by worker name'''
+
+
+class SupervisedWorker:
+    '''
+    One restartable task, state dict is handed to every incarnation
+    so caches and connections outlive failures
+    '''
+
+    def __init__(self, name: str, factory: Callable) -> None:
+        self.name = name
+        self.factory = factory
+        self.state = {}
+        self.task: Optional[asyncio.Task] = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restarted_at = deque()
+        self.reported_error = None
+        self.down = False
+
+    def get_backoff(self) -> float:
+        '''Doubling delay of consecutive failures'''
+        return min(SUPERVISOR_MAX_BACKOFF, SUPERVISOR_BACKOFF * 2 ** (self.failures - 1))
+
+    def __str__(self) -> str:
+        if self.down:
+            status = 'down'
+        elif self.task is None or self.task.done():
+            status = 'restarting'
+        else:
+            status = f'up {time.monotonic() - self.started_at:.0f}s'
+        return f'{self.name}: {status}, failures in window {len(self.restarted_at)}'
+
+class Supervisor:
+    '''
+    One-for-one supervision on event loop
+    Worker end is detected by task done callback, never by polling,
+    any end is a failure: restart after backoff, or give up when
+    worker restarts too often, other workers keep running
+    '''
+
+    def __init__(self) -> None:
+        self.workers = {}
+        self.notify: Callable = print
+        self.closing = False
+        self.all_down = None
+
+    def supervise(self, name: str, factory: Callable) -> None:
+        '''Start worker, factory(state) returns its coroutine'''
+        worker = SupervisedWorker(name, factory)
+        self.workers[name] = worker
+        self.start_worker(worker)
+
+    def start_worker(self, worker: SupervisedWorker) -> None:
+        '''New incarnation of worker, unless it was stopped meanwhile'''
+        if self.closing or self.workers.get(worker.name) is not worker:
+            return
+        worker.started_at = time.monotonic()
+        worker.reported_error = None
+        worker.task = asyncio.create_task(
+            worker.factory(worker.state),
+            name='task ' + worker.name
+        )
+        worker.task.add_done_callback(lambda task: self.handle_done(worker, task))
+
+    def handle_done(self, worker: SupervisedWorker, task: asyncio.Task) -> None:
+        '''Schedule restart or give up'''
+        if self.closing or task is not worker.task:
+            return
+        if worker.reported_error is not None:
+            error = worker.reported_error
+        elif task.cancelled():
+            error = 'cancelled'
+        else:
+            error = task.exception() or 'returned'
+
+        now = time.monotonic()
+        if now - worker.started_at >= SUPERVISOR_STABLE_AFTER:
+            worker.failures = 0
+        worker.failures += 1
+        worker.restarted_at.append(now)
+        while worker.restarted_at[0] < now - SUPERVISOR_RESTART_WINDOW:
+            worker.restarted_at.popleft()
+
+        if len(worker.restarted_at) > SUPERVISOR_MAX_RESTARTS:
+            worker.down = True
+            self.notify(f'{worker.name} is down: {error!r}, {SUPERVISOR_MAX_RESTARTS} restarts failed')
+            if all(other.down for other in self.workers.values()):
+                self.get_all_down().set()
+            return
+        backoff = worker.get_backoff()
+        WORKER_RESTARTS.inc(worker.name)
+        self.notify(f'{worker.name} failed: {error!r}, restart in {backoff:.1f}s')
+        asyncio.get_running_loop().call_later(backoff, self.start_worker, worker)
+
+    def fail(self, name: str, error: BaseException) -> None:
+        '''Failure detected outside of worker task, stops and restarts it'''
+        worker = self.workers.get(name)
+        if worker is not None and worker.task is not None and not worker.task.done():
+            worker.reported_error = error
+            worker.task.cancel()
+
+    def stop(self, name: str) -> None:
+        '''Cancel worker for good, without restart'''
+        worker = self.workers.pop(name)
+        task, worker.task = worker.task, None
+        if task is not None:
+            task.cancel()
+
+    def get_all_down(self) -> asyncio.Event:
+        '''Event of the running loop'''
+        if self.all_down is None:
+            self.all_down = asyncio.Event()
+        return self.all_down
+
+    async def wait(self) -> None:
+        '''
+        Until every worker gave up, cancelling waiter
+        stops all workers without restart
+        '''
+        try:
+            await self.get_all_down().wait()
+        finally:
+            self.closing = True
+            for worker in self.workers.values():
+                if worker.task is not None:
+                    worker.task.cancel()
+
+    def summary(self) -> str:
+        '''Human readable status of workers'''
+        return '\n'.join(str(worker) for worker in self.workers.values())
+
+SUPERVISOR = Supervisor()
+'''Workers of the bot, notifications go to telegram once bot is created'''
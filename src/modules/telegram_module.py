@@ -1,5 +1,11 @@
 '''Logging and managing trading bot using telegram bot'''
 
+import time
+import queue
+import threading
+import functools
+from typing import Callable
+
 from telegram import (
     Update,
     Bot
@@ -8,26 +14,245 @@ from telegram.ext import (
     CallbackContext,
     Updater,
     Filters,
+    CommandHandler,
     MessageHandler,
 )
 from ..settings import (
     TELEGRAM_API_TOKEN,
-    TELEGRAM_ADMIN_ID
+    TELEGRAM_ADMIN_ID,
+    ENABLE_TELEGRAM_MODULE,
+    TELEGRAM_QUEUE_SIZE,
+    TELEGRAM_BATCH_INTERVAL,
+    TELEGRAM_MESSAGES_PER_MINUTE,
+    TELEGRAM_DELAYED_AFTER
 )
 from .mail_handler import StrategyAlert
+from .rate_limiter import (
+    RATE_LIMITER,
+    TokenBucket
+)
+from .portfolio_store import PORTFOLIO
+from .operations_store import OperationsStore
+from .journal import JOURNAL
+from .supervisor import SUPERVISOR
+from .strategy_registry import STRATEGY_REGISTRY
+from .metrics import (
+    ALERT_TO_ORDER_LATENCY,
+    ORDER_QUEUE_WAIT,
+    ORDER_QUEUE_DEPTH,
+    STAGE_LATENCY,
+    ALERTS,
+    TELEGRAM_MESSAGES
+)
 
-TELEGRAM_ADMIN_ID = int(TELEGRAM_ADMIN_ID)
+TELEGRAM_ADMIN_ID = int(TELEGRAM_ADMIN_ID) if TELEGRAM_ADMIN_ID else None
 
-def dummy_message_handler(update: Update, context: CallbackContext) -> None:
-    '''dummy for handlig all messages'''
-    if update.message.chat_id == TELEGRAM_ADMIN_ID:
-        update.message.reply_text(
-            text='okey-dokey'
+class ConsoleBot:
+    '''Prints admin messages when telegram module is disabled'''
+
+    def send_message(self, chat_id, text, **kwargs) -> None:
+        print(text)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+'''Max characters of one telegram message'''
+
+class TelegramNotifier:
+    '''
+    Single background sender in front of bot
+    send_message only enqueues and never blocks, messages arriving
+    within batch interval are joined into one message per chat,
+    sending is throttled to telegram rate limit
+    Full queue drops new messages and counts them
+    '''
+
+    def __init__(
+        self,
+        bot,
+        queue_size: int = TELEGRAM_QUEUE_SIZE,
+        batch_interval: float = TELEGRAM_BATCH_INTERVAL,
+        messages_per_minute: float = TELEGRAM_MESSAGES_PER_MINUTE
+    ) -> None:
+        self.bot = bot
+        self.queue = queue.Queue(queue_size)
+        self.batch_interval = batch_interval
+        self.bucket = TokenBucket('telegram', messages_per_minute)
+        self.thread = threading.Thread(target=self.sustain_sending, daemon=True)
+        self.thread.name = 'thread telegram notifier'
+        self.thread.start()
+
+    def send_message(self, chat_id, text, disable_notification: bool = False, **kwargs) -> None:
+        '''Bot compatible, enqueue message or drop it if queue is full'''
+        try:
+            self.queue.put_nowait((time.monotonic(), chat_id, str(text), disable_notification))
+        except queue.Full:
+            TELEGRAM_MESSAGES.inc('dropped')
+
+    def collect_batch(self) -> list:
+        '''Block for first message, then take what arrives within interval'''
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def sustain_sending(self) -> None:
+        '''Coalesce and send forever'''
+        while True:
+            batch = self.collect_batch()
+            by_chat = {}
+            for enqueued_at, chat_id, text, disable_notification in batch:
+                texts, silent = by_chat.get(chat_id, ([], True))
+                texts.append(text)
+                by_chat[chat_id] = (texts, silent and disable_notification)
+            for chat_id, (texts, silent) in by_chat.items():
+                for chunk in split_message('\n'.join(texts)):
+                    self.bucket.acquire()
+                    try:
+                        self.bot.send_message(chat_id, chunk, disable_notification=silent)
+                        TELEGRAM_MESSAGES.inc('batches')
+                    except Exception as e: # network or telegram error, never kill sender
+                        TELEGRAM_MESSAGES.inc('failed')
+                        print(f'telegram notifier failed: {e}')
+            now = time.monotonic()
+            for enqueued_at, *message in batch:
+                STAGE_LATENCY.observe('notify_send', now - enqueued_at)
+            TELEGRAM_MESSAGES.inc('sent', len(batch))
+            TELEGRAM_MESSAGES.inc('delayed', sum(
+                1 for enqueued_at, *message in batch
+                if now - enqueued_at > TELEGRAM_DELAYED_AFTER
+            ))
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self, timeout: float) -> bool:
+        '''Wait until queue is sent, returns False on timeout'''
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def summary(self) -> str:
+        '''Human readable counters line'''
+        counts = TELEGRAM_MESSAGES.values
+        return (
+            f'telegram: sent={counts.get("sent", 0)} in {counts.get("batches", 0)} messages '
+            f'queued={self.queue.qsize()} dropped={counts.get("dropped", 0)} '
+            f'delayed={counts.get("delayed", 0)} failed={counts.get("failed", 0)}'
         )
-    else:
-        update.message.reply_text(
-            text='Access denied'
+
+def split_message(text: str) -> list:
+    '''Chunks within telegram message limit, split by lines when possible'''
+    chunks = []
+    while len(text) > TELEGRAM_MESSAGE_LIMIT:
+        split_at = text.rfind('\n', 0, TELEGRAM_MESSAGE_LIMIT)
+        if split_at <= 0:
+            split_at = TELEGRAM_MESSAGE_LIMIT
+        chunks.append(text[:split_at])
+        text = text[split_at:].lstrip('\n')
+    chunks.append(text)
+    return chunks
+
+NOTIFIERS = []
+'''Created notifiers, for admin statistics'''
+
+def is_admin(update: Update) -> bool:
+    '''Message comes from admin chat, admin id is a string from environment'''
+    return update.effective_chat is not None and str(update.effective_chat.id) == str(TELEGRAM_ADMIN_ID)
+
+def admin_command(callback: Callable) -> Callable:
+    '''Command handler callback answering admin only'''
+
+    def handle_command(update: Update, context: CallbackContext) -> None:
+        if is_admin(update):
+            update.effective_message.reply_text(text=callback(context.args))
+        else:
+            update.effective_message.reply_text(text='Access denied')
+
+    return handle_command
+
+def latency_command(args: list) -> str:
+    '''/latency'''
+    return '\n'.join((
+        ALERT_TO_ORDER_LATENCY.summary(),
+        ORDER_QUEUE_WAIT.summary(),
+        ORDER_QUEUE_DEPTH.summary(),
+        STAGE_LATENCY.summary(),
+        ALERTS.summary(),
+        RATE_LIMITER.summary(),
+        *(notifier.summary() for notifier in NOTIFIERS)
+    ))
+
+def workers_command(args: list) -> str:
+    '''/workers'''
+    return SUPERVISOR.summary() or 'no workers'
+
+def positions_command(args: list) -> str:
+    '''/positions'''
+    return PORTFOLIO.summary() or 'no accounts tracked'
+
+@functools.lru_cache(maxsize=None)
+def get_operations_store() -> OperationsStore:
+    '''Operations store shared by /pnl calls, opened on first use'''
+    return OperationsStore()
+
+def pnl_command(args: list) -> str:
+    '''/pnl, payments and commissions of every tracked account'''
+    operations_store = get_operations_store()
+    lines = []
+    for broker_id in list(PORTFOLIO.accounts) or [None]: # keys are canonical account ids
+        operations_store.sync(broker_id)
+        payment_totals = operations_store.get_payment_totals(broker_id)
+        lines.append(f'{broker_id or "default"}:' + ('' if payment_totals else ' no operations'))
+        lines.extend(
+            f'{figi or currency}: payments {payment} {currency}, commissions {commission}'
+            for (figi, currency), (payment, commission) in sorted(payment_totals.items(), key=str)
         )
+    return '\n'.join(lines)
+
+def journal_command(args: list) -> str:
+    '''/journal STRATEGY_OR_FIGI'''
+    if len(args) != 1:
+        return 'usage: /journal STRATEGY_OR_FIGI'
+    return JOURNAL.summary(args[0]) or 'no entries'
+
+def strategies_command(args: list) -> str:
+    '''/strategies'''
+    return STRATEGY_REGISTRY.summary() or 'no strategies'
+
+def strategy_command(args: list) -> str:
+    '''/strategy add NAME TICKER [ACCOUNT] or /strategy remove NAME'''
+    if len(args) in (3, 4) and args[0] == 'add':
+        return STRATEGY_REGISTRY.change(*args[1:])
+    if len(args) == 2 and args[0] == 'remove':
+        return STRATEGY_REGISTRY.change(args[1], None)
+    return 'usage: /strategy add NAME TICKER [ACCOUNT] or /strategy remove NAME'
+
+ADMIN_COMMANDS = {
+    'latency': latency_command,
+    'workers': workers_command,
+    'positions': positions_command,
+    'pnl': pnl_command,
+    'journal': journal_command,
+    'strategies': strategies_command,
+    'strategy': strategy_command
+}
+'''Telegram commands of admin, callback(args) returns reply text'''
+
+def dummy_message_handler(update: Update, context: CallbackContext) -> None:
+    '''dummy for handlig all other messages, stickers and photos included'''
+    if update.effective_message is None:
+        return
+    update.effective_message.reply_text(
+        text='okey-dokey' if is_admin(update) else 'Access denied'
+    )
 
 def sustain_dedicated_telegram_handler():
     '''handler for all incoming messages'''
@@ -35,6 +260,10 @@ def sustain_dedicated_telegram_handler():
         token=TELEGRAM_API_TOKEN,
         use_context=True
     )
+    for command, callback in ADMIN_COMMANDS.items():
+        updater.dispatcher.add_handler(
+            CommandHandler(command, admin_command(callback))
+        )
     updater.dispatcher.add_handler(
         MessageHandler(
             filters=Filters.all,
@@ -43,9 +272,13 @@ def sustain_dedicated_telegram_handler():
     )
     updater.start_polling(poll_interval=0.5)
 
-def create_telegram_bot() -> Bot:
-    '''Creating bot object'''
-    return Bot(TELEGRAM_API_TOKEN)
+def create_telegram_bot() -> TelegramNotifier:
+    '''Creating bot object behind background notifier'''
+    notifier = TelegramNotifier(
+        Bot(TELEGRAM_API_TOKEN) if ENABLE_TELEGRAM_MODULE else ConsoleBot()
+    )
+    NOTIFIERS.append(notifier)
+    return notifier
 
 def telegram_basic_log(bot: Bot, message: str) -> None: # for testing purpose
     '''Send message to admin'''
@@ -1,14 +1,33 @@
 '''Basic functions for tinkoff API'''
 
 import json
-from typing import Optional, Union
+import threading
+from typing import Optional
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from ..settings import (
     TINKOFF_API_TOKEN,
+    TINKOFF_API_URL,
+    TINKOFF_POOL_SIZE,
+    TINKOFF_TIMEOUT,
+    TINKOFF_RETRIES,
+    TINKOFF_FAST_DECODING,
     TINKOFF_IIS_ID,
     TINKOFF_ID
 )
 from pydantic import BaseModel
+from .rate_limiter import (
+    RATE_LIMITER,
+    ORDER_PRIORITY,
+    READ_PRIORITY
+)
+from .fast_decoding import construct_response
+from .journal import JOURNAL
+from .metrics import (
+    CURRENT_TRACE,
+    timed_stage
+)
 from .tinkoff_classes import (
     TinkoffBaseResponse,
     TinkoffErrorObject,
@@ -44,9 +63,80 @@ from .tinkoff_classes import (
     UserAccountsResponse
 )
 
-API = 'https://api-invest.tinkoff.ru/openapi/'
+API = TINKOFF_API_URL
 HEADERS = {'Authorization': f'Bearer {TINKOFF_API_TOKEN}'}
 
+class TinkoffClient:
+    '''
+    Keep-alive HTTP client shared by all trading threads
+    Every thread gets own session on top of one pooled adapter,
+    so connections are reused without sharing session state
+    '''
+
+    def __init__(
+        self,
+        pool_size: int = TINKOFF_POOL_SIZE,
+        timeout=TINKOFF_TIMEOUT,
+        retries: int = TINKOFF_RETRIES
+    ) -> None:
+        self.timeout = timeout
+        self.adapter = HTTPAdapter(
+            pool_connections=1, # single host
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET']), # never resend orders
+                backoff_factor=0.1,
+                raise_on_status=False
+            )
+        )
+        self.local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        '''Session of current thread'''
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            session.mount(API, self.adapter)
+            self.local.session = session
+        return session
+
+    def get(
+        self,
+        endpoint: str,
+        params: Optional[dict] = None
+    ) -> requests.Response:
+        '''GET request to api endpoint'''
+        return self.session.get(
+            API + endpoint,
+            params=params,
+            timeout=self.timeout
+        )
+
+    def post(
+        self,
+        endpoint: str,
+        data: Optional[str] = None,
+        params: Optional[dict] = None
+    ) -> requests.Response:
+        '''POST request to api endpoint'''
+        return self.session.post(
+            API + endpoint,
+            data=data,
+            params=params,
+            timeout=self.timeout
+        )
+
+CLIENT = TinkoffClient()
+'''Shared client for all api functions'''
+
 class TinkoffError(Exception):
     '''Base class for Tinkoff exception'''
     def __init__(self, TinkoffErrorObject):
@@ -54,52 +144,121 @@ class TinkoffError(Exception):
         self.message = TinkoffErrorObject.payload.message
         self.code = TinkoffErrorObject.payload.code
 
-def observe_tinkoff_exception(response_json: str): # for testing purpose
+def observe_tinkoff_exception(response_object: dict): # for testing purpose
     '''Raise exception if tinkoff server cannot handle request
     Has tracking_id, message, code'''
-    examinated_response_object = TinkoffBaseResponse.parse_raw(response_json)
-    if examinated_response_object.status == 'Error':
-        error_object = TinkoffErrorObject.parse_raw(response_json)
+    if response_object.get('status') == 'Error':
+        error_object = TinkoffErrorObject.parse_obj(response_object)
         print(error_object)
         raise TinkoffError(error_object)
 
+def parse_tinkoff_response(
+    response_content: bytes,
+    response_model: type[TinkoffBaseResponse],
+    fast: Optional[bool] = None
+) -> TinkoffBaseResponse:
+    '''
+    Decode raw response once and dispatch by status
+    to error model (raises TinkoffError) or to response_model
+    Fast mode (TINKOFF_FAST_DECODING by default) skips validation
+    of successful responses, errors are always validated
+    '''
+    response_object = json.loads(response_content)
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.tracking_ids.append(response_object.get('trackingId'))
+    observe_tinkoff_exception(response_object)
+    if TINKOFF_FAST_DECODING if fast is None else fast:
+        return construct_response(response_object, response_model)
+    return response_model.parse_obj(response_object)
+
+class BrokerAccounts:
+    '''
+    Account ids by account type, /user/accounts is requested
+    once on first unknown account, ids from settings win over discovered ones
+    '''
+
+    def __init__(self) -> None:
+        self.ids_by_type = {
+            account_type: account_id for account_type, account_id in (
+                ('TinkoffIis', TINKOFF_IIS_ID),
+                ('Tinkoff', TINKOFF_ID)
+            ) if account_id
+        }
+        self.ids = set(self.ids_by_type.values())
+        self.discovered = False
+        self.lock = threading.Lock()
+
+    def discover(self) -> None:
+        '''Fetch accounts of token (blocking), only the first call requests'''
+        with self.lock:
+            if self.discovered:
+                return
+            for account in get_user_accounts():
+                self.ids_by_type.setdefault(account.broker_account_type, account.broker_account_id)
+                self.ids.add(account.broker_account_id)
+            self.discovered = True
+
+    def resolve(self, account: Optional[str] = None) -> str:
+        '''
+        Canonical account id for account type or id, None is default
+        Tinkoff account, so every alias of one account gives the same id
+        ValueError if token has no such account
+        '''
+        account = account or 'Tinkoff'
+        if account not in self.ids_by_type and account not in self.ids:
+            self.discover()
+        if account in self.ids_by_type:
+            return self.ids_by_type[account]
+        if account in self.ids:
+            return account
+        raise ValueError(f'unknown broker account {account}')
+
+BROKER_ACCOUNTS = BrokerAccounts()
+'''Accounts of the token, shared by all api calls'''
+
 def setup_broker_id(
     broker_id: Optional[str] = None
-) -> Union[None, str]:
-    '''Setting broker account param for work'''
-    if broker_id == 'TinkoffIis':
-        broker_id = {'brokerAccountId': TINKOFF_IIS_ID}
-    if broker_id == 'Tinkoff':
-        broker_id = {'brokerAccountId': TINKOFF_ID}
-    return broker_id
+) -> Optional[dict]:
+    '''
+    Setting broker account param for work, broker_id is account type
+    ("Tinkoff", "TinkoffIis") or account id, None is default account
+    '''
+    if not broker_id:
+        return None
+    return {'brokerAccountId': BROKER_ACCOUNTS.resolve(broker_id)}
 
 def send_get_request(
     endpoint: str,
     params: Optional[dict] = None
-) -> str:
-    '''using endpoint for api and params returns response str in json format'''
-    return json.dumps(
-        requests.get(
-            API + endpoint,
-            headers=HEADERS,
-            params=params
-        ).json()
-    )
+) -> bytes:
+    '''using endpoint for api and params returns raw response bytes in json format'''
+    RATE_LIMITER.acquire(endpoint, READ_PRIORITY)
+    return CLIENT.get(
+        endpoint,
+        params=params
+    ).content
 
 def send_post_request(
     endpoint: str,
-    body: Optional[dict] = None,
+    body: Optional[BaseModel] = None,
     params: Optional[dict] = None
-) -> str:
-    '''using endpoint for api, body and params returns response str in json format'''
-    return json.dumps(
-        requests.post(
-            API + endpoint,
-            data=json.dumps(body),
-            headers=HEADERS,
-            params=params
-        ).json()
+) -> bytes:
+    '''using endpoint for api, body model and params returns raw response bytes in json format'''
+    RATE_LIMITER.acquire(endpoint, ORDER_PRIORITY) # all posts are orders
+    data = body.json() if body else None
+    JOURNAL.record(
+        'request',
+        {'endpoint': endpoint, 'body': body, 'params': params},
+        params and params.get('figi'),
+        params and params.get('brokerAccountId')
     )
+    with timed_stage('order_post'):
+        return CLIENT.post(
+            endpoint,
+            data=data,
+            params=params
+        ).content
 
 def get_orders(
     broker_id: Optional[str] = None
@@ -108,13 +267,13 @@ def get_orders(
     All active orders as list
     https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/orders/get_orders
     '''
-    response_json = send_get_request(
+    response_content = send_get_request(
         'orders',
         setup_broker_id(broker_id)
     )
-    observe_tinkoff_exception(response_json)
-    return OrdersResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        OrdersResponse
     ).payload
 
 def post_limit_order(
@@ -130,15 +289,17 @@ def post_limit_order(
     if broker_id:
         params.update(setup_broker_id(broker_id))
 
-    response_json = send_post_request(
+    response_content = send_post_request(
         'orders/limit-order',
-        body=json.loads(body.json()), #{'lots': 1, 'operation': 'Sell', 'price': 1.5}
+        body=body, #{'lots': 1, 'operation': 'Sell', 'price': 1.5}
         params=params
     )
-    observe_tinkoff_exception(response_json)
-    return LimitOrderResponse.parse_raw(
-        response_json
+    placed_order = parse_tinkoff_response(
+        response_content,
+        LimitOrderResponse
     ).payload
+    JOURNAL.record('limit order', placed_order, figi, broker_id)
+    return placed_order
 
 def post_market_order(
     body: MarketOrderRequest,
@@ -154,15 +315,17 @@ def post_market_order(
     if broker_id:
         params.update(setup_broker_id(broker_id))
 
-    response_json = send_post_request(
+    response_content = send_post_request(
         'orders/market-order',
-        body=json.loads(body.json()), #{'lots': 1, 'operation': 'Sell'}
+        body=body, #{'lots': 1, 'operation': 'Sell'}
         params=params
     )
-    observe_tinkoff_exception(response_json)
-    return MarketOrderResponse.parse_raw(
-        response_json
+    placed_order = parse_tinkoff_response(
+        response_content,
+        MarketOrderResponse
     ).payload
+    JOURNAL.record('market order', placed_order, figi, broker_id)
+    return placed_order
 
 def post_order_cancel(
     order_id: str,
@@ -176,13 +339,13 @@ def post_order_cancel(
     if broker_id:
         params.update(setup_broker_id(broker_id))
 
-    response_json = send_post_request(
+    response_content = send_post_request(
         'orders/cancel',
         params=params
     )
-    observe_tinkoff_exception(response_json)
-    return Empty.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        Empty
     )
 
 def get_portfolio(
@@ -192,13 +355,13 @@ def get_portfolio(
     All active positions as list
     https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/portfolio/get_portfolio
     '''
-    response_json = send_get_request(
+    response_content = send_get_request(
         'portfolio',
         params=setup_broker_id(broker_id)
     )
-    observe_tinkoff_exception(response_json)
-    return PortfolioResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        PortfolioResponse
     ).payload.positions
 
 def get_portfolio_currencies(
@@ -208,30 +371,32 @@ def get_portfolio_currencies(
     All currencies balances as list
     https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/portfolio/get_portfolio_currencies
     '''
-    response_json = send_get_request(
+    response_content = send_get_request(
         'portfolio/currencies',
         params=setup_broker_id(broker_id)
     )
-    observe_tinkoff_exception(response_json)
-    return PortfolioCurrenciesResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        PortfolioCurrenciesResponse
     ).payload.currencies
 
 def get_orderbook(
     figi: str,
-    depth: int
+    depth: int,
+    fast: Optional[bool] = None
 ) -> OrderBook:
     '''
     Orderbook container with 2 lists "asks" and "bids" with objects (ammount = depth <20)
     https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/market/get_market_orderbook
     '''
-    response_json = send_get_request(
+    response_content = send_get_request(
         'market/orderbook',
         params={'figi': figi, 'depth': depth}
     )
-    observe_tinkoff_exception(response_json)
-    return OrderbookResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        OrderbookResponse,
+        fast
     ).payload
 
 def get_stock_by_figi(
@@ -241,13 +406,13 @@ def get_stock_by_figi(
     Found result for figi as object
     https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/market/get_market_search_by_figi
     '''
-    response_json = send_get_request(
+    response_content = send_get_request(
         'market/search/by-figi',
         params={'figi': figi}
     )
-    observe_tinkoff_exception(response_json)
-    return SearchMarketInstumentResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        SearchMarketInstumentResponse
     ).payload
 
 def get_stock_by_ticker(
@@ -257,13 +422,26 @@ def get_stock_by_ticker(
     All found results for ticker as list
     https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/market/get_market_search_by_ticker
     '''
-    response_json = send_get_request(
+    response_content = send_get_request(
         'market/search/by-ticker',
         params={'ticker': ticker}
     )
-    observe_tinkoff_exception(response_json)
-    return MarketInstrumentListResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        MarketInstrumentListResponse
+    ).payload.instruments
+
+def get_market_stocks() -> MarketInstrumentList:
+    '''
+    All available stocks as list
+    https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/market/get_market_stocks
+    '''
+    response_content = send_get_request(
+        'market/stocks'
+    )
+    return parse_tinkoff_response(
+        response_content,
+        MarketInstrumentListResponse
     ).payload.instruments
 
 def get_operations(
@@ -282,13 +460,13 @@ def get_operations(
     if figi:
         params.update({'figi': figi})
 
-    response_json = send_get_request(
-        '/operations',
+    response_content = send_get_request(
+        'operations',
         params=params
     )
-    observe_tinkoff_exception(response_json)
-    return OperationsResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        OperationsResponse
     ).payload.operations
 
 def get_user_accounts() -> UserAccounts:
@@ -296,10 +474,10 @@ def get_user_accounts() -> UserAccounts:
     Returns all trading accounts as list
     https://tinkoffcreditsystems.github.io/invest-openapi/swagger-ui/#/user/get_user_accounts
     '''
-    response_json = send_get_request(
+    response_content = send_get_request(
             'user/accounts'
         )
-    observe_tinkoff_exception(response_json)
-    return UserAccountsResponse.parse_raw(
-        response_json
+    return parse_tinkoff_response(
+        response_content,
+        UserAccountsResponse
     ).payload.accounts
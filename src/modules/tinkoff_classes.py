@@ -213,7 +213,7 @@ class OrderBook(BaseModel):
     depth: int
     bids: list[OrderResponse]
     asks: list[OrderResponse]
-    trade_status: Optional[str] = Field(alias='TradeStatus')
+    trade_status: Optional[str] = Field(alias='tradeStatus')
     min_price_increment: Decimal = Field(alias='minPriceIncrement')
     face_value: Optional[Decimal] = Field(alias='faceValue')
     last_price: Optional[Decimal] = Field(alias='lastPrice')
@@ -240,7 +240,7 @@ class SearchMarketInstrument(BaseModel):
     figi: str
     ticker: str
     isin: Optional[str]
-    min_price_increment: Optional[Decimal] = Field(alias='minPriceIncrenent')
+    min_price_increment: Optional[Decimal] = Field(alias='minPriceIncrement')
     lot: int
     currency: Optional[str]
     name: str
@@ -266,7 +266,7 @@ class MarketInstrument(BaseModel):
     figi: str
     ticker: str
     isin: Optional[str]
-    min_price_increment: Optional[Decimal] = Field(alias='minPriceIncrenent')
+    min_price_increment: Optional[Decimal] = Field(alias='minPriceIncrement')
     lot: int
     min_quantity: Optional[int] = Field(alias='minQuantity')
     currency: Optional[str]
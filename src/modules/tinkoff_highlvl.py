@@ -35,25 +35,87 @@ from .tinkoff_classes import (
     UserAccountsResponse
 )
 
+from typing import Optional
 from .tinkoff_api import (
-    get_stock_by_ticker,
     post_limit_order,
     post_market_order
 )
+from .instrument_cache import INSTRUMENTS
 
 
 def get_figi_by_ticker(ticker: str) -> str:
     '''Figi in str for exact ticker'''
-    return get_stock_by_ticker(ticker)[0].figi
+    return INSTRUMENTS.get_by_ticker(ticker).figi
 
-def create_market_order(strategy_alert, figi: str) -> PlacedMarketOrder:
-    '''Execute strategy using market order'''
+def execute_order(
+    figi: str,
+    operation: str,
+    lots: int,
+    broker_id: Optional[str] = None
+) -> PlacedMarketOrder:
+    '''
+    Buy or sell lots by market order, limit mode runs
+    on event loop by limit_execution.execute_limit_order instead
+    '''
     return post_market_order(
         MarketOrderRequest.parse_obj(
             {
-                'lots': strategy_alert.quantity,
-                'operation': strategy_alert.order_action.capitalize()
+                'lots': lots,
+                'operation': operation
             }
         ),
-        figi
+        figi,
+        broker_id
+    )
+
+def create_market_order(
+    strategy_alert,
+    figi: str,
+    broker_id: Optional[str] = None
+) -> PlacedMarketOrder:
+    '''Execute strategy using alert quantity'''
+    return execute_order(
+        figi,
+        strategy_alert.order_action.capitalize(),
+        strategy_alert.quantity,
+        broker_id
+    )
+
+def get_target_lots(strategy_alert, lot: int) -> int:
+    '''
+    Signed lots strategy wants to hold, alert position is in shares
+    Short and flat market position override position sign
+    '''
+    if strategy_alert.market_position.lower() == 'flat':
+        return 0
+    shares = abs(strategy_alert.position)
+    if strategy_alert.market_position.lower() == 'short':
+        shares = -shares
+    lots = abs(shares) // lot # never overshoot target
+    return lots if shares >= 0 else -lots
+
+def get_target_delta(strategy_alert, figi: str, held_lots: int) -> int:
+    '''Signed lots moving holding to alert position'''
+    return get_target_lots(strategy_alert, INSTRUMENTS.get_by_figi(figi).lot) - held_lots
+
+def create_target_position_order(
+    strategy_alert,
+    figi: str,
+    position_store,
+    broker_id: Optional[str] = None
+) -> Optional[PlacedMarketOrder]:
+    '''
+    Execute strategy by moving holding to alert position
+    Holding is read from position store here, in sharded mode
+    it is a blocking call of coordinator
+    Returns None without api call if holding is already at target
+    '''
+    delta_lots = get_target_delta(strategy_alert, figi, position_store.get_lots(figi))
+    if not delta_lots:
+        return None
+    return execute_order(
+        figi,
+        'Buy' if delta_lots > 0 else 'Sell',
+        abs(delta_lots),
+        broker_id
     )
@@ -0,0 +1,90 @@
+'''TradingView webhook receiver, alternative to email alerts'''
+
+import hmac
+import time
+from typing import Callable
+from pydantic import ValidationError
+from tornado.web import (
+    Application,
+    RequestHandler
+)
+from tornado.httpserver import HTTPServer
+from ..settings import (
+    WEBHOOK_ADDRESS,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET
+)
+from .mail_handler import (
+    StrategyAlert,
+    find_alert_bounds
+)
+from .metrics import (
+    STAGE_LATENCY,
+    ALERTS,
+    AlertTrace
+)
+
+
+def get_strategy_alert_webhook_content(body: bytes) -> StrategyAlert:
+    '''Alert json as is or wrapped in MESSAGE_START/MESSAGE_END'''
+    bounds = find_alert_bounds(body)
+    if bounds:
+        start, end = bounds
+        body = body[start:end]
+    return StrategyAlert.parse_raw(body)
+
+class StrategyAlertHandler(RequestHandler):
+    '''
+    POST /alert/<strategy_name>?secret=<WEBHOOK_SECRET>
+    secret may also be sent as X-Webhook-Secret header
+    body is README strategy alert message
+    '''
+
+    def initialize(self, strategy_names, deliver: Callable) -> None:
+        self.strategy_names = strategy_names
+        self.deliver = deliver
+
+    def post(self, strategy_name: str) -> None:
+        received = time.monotonic()
+        secret = self.request.headers.get(
+            'X-Webhook-Secret',
+            self.get_query_argument('secret', '')
+        )
+        if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            self.send_error(403)
+            return
+        if strategy_name not in self.strategy_names:
+            self.send_error(404)
+            return
+        ALERTS.inc('received')
+        parse_started = time.monotonic()
+        try:
+            strategy_alert = get_strategy_alert_webhook_content(self.request.body)
+        except ValidationError as e:
+            ALERTS.inc('broken')
+            self.set_status(400)
+            self.finish(e.json())
+            return
+        STAGE_LATENCY.observe('alert_parse', time.monotonic() - parse_started)
+        strategy_alert._trace = AlertTrace(strategy_name, 'webhook', received)
+        strategy_alert._trace.mark('alert_parse')
+        self.deliver(strategy_name, strategy_alert)
+        self.set_status(202)
+        self.finish()
+
+def start_webhook_server(
+    strategy_names,
+    deliver: Callable,
+    port: int = WEBHOOK_PORT
+) -> HTTPServer:
+    '''Listen on running event loop, alerts go to deliver(strategy_name, strategy_alert)'''
+    if not WEBHOOK_SECRET:
+        raise ValueError('WEBHOOK_SECRET must be set to enable webhook')
+    application = Application([
+        (
+            r'/alert/([^/]+)',
+            StrategyAlertHandler,
+            {'strategy_names': strategy_names, 'deliver': deliver}
+        )
+    ])
+    return application.listen(port, WEBHOOK_ADDRESS)
@@ -7,6 +7,89 @@ TINKOFF_API_TOKEN = os.getenv('TINKOFF_API_TOKEN')
 #TINKOFF_API_TOKEN = 'your_token'
 '''Token from tinkoff'''
 
+TINKOFF_API_URL = os.getenv('TINKOFF_API_URL', 'https://api-invest.tinkoff.ru/openapi/')
+'''Api root, may point to benchmarks/mock_tinkoff_server.py'''
+
+TINKOFF_POOL_SIZE = 10
+'''Max keep-alive connections to tinkoff api shared by all threads'''
+
+TINKOFF_TIMEOUT = (3.05, 10)
+'''Connect and read timeouts for tinkoff api in seconds'''
+
+TINKOFF_RETRIES = 3
+'''Retries on connection errors, reads are retried only for GET'''
+
+TINKOFF_FAST_DECODING = False
+'''
+Build response models without validation, decimals stay floats
+and orderbook sides are arrays, keep False to debug api changes
+'''
+
+ORDER_WORKERS = 4
+'''
+Orders executed in parallel per broker account, every account has
+its own queue and workers, same account and figi are always serialized
+'''
+
+ORDER_QUEUE_SIZE = 100
+'''Alerts waiting for order worker before strategies are slowed down'''
+
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', '1'))
+'''
+Trading processes, strategies are split round robin by name,
+shard n listens webhook on WEBHOOK_PORT + n and metrics on METRICS_PORT + 1 + n,
+main process coordinates positions, rate limits and telegram
+'''
+
+SUPERVISOR_BACKOFF = 1
+SUPERVISOR_MAX_BACKOFF = 60
+SUPERVISOR_STABLE_AFTER = 60
+'''Seconds before first restart (doubling up to max), run time which resets backoff'''
+
+SUPERVISOR_MAX_RESTARTS = 10
+SUPERVISOR_RESTART_WINDOW = 600
+'''Worker restarting more often than that within window seconds is left down'''
+
+TINKOFF_RATE_LIMITS = {
+    'orders': 100,
+    'market': 240,
+    'portfolio': 120,
+    'operations': 120,
+    'user': 120
+}
+'''Requests per minute allowed by tinkoff for endpoint groups'''
+
+ORDER_SIZING_MODE = 'quantity'
+'''
+"quantity" sends alert quantity as is,
+"target" trades only the difference between alert position and holding
+'''
+
+ORDER_EXECUTION_MODE = 'market'
+'''"market" orders, or "limit" near the touch with market fallback'''
+
+LIMIT_ORDER_TIMEOUT = 10
+LIMIT_FIRST_POLL = 0.5
+LIMIT_REPRICES = 2
+LIMIT_CONFIRM_ATTEMPTS = 3
+'''
+Seconds limit order may rest, first fill check (then doubling), reprices before market,
+checks of operations confirming executed lots of finished limit order
+'''
+
+ENABLE_ORDERBOOK_SAMPLER = ORDER_EXECUTION_MODE == 'limit'
+ORDERBOOK_DEPTH = 20
+ORDERBOOK_SAMPLE_INTERVAL = 5
+ORDERBOOK_MAX_AGE = 30
+'''
+Background orderbooks of traded figis: depth, seconds between samples, max age used
+Samples use market quota, so only limit mode needs them by default,
+expected fill price of every alert goes to its trace
+'''
+
+PORTFOLIO_RECONCILE_INTERVAL = 60
+'''Seconds between checks of local positions against tinkoff portfolio'''
+
 TINKOFF_IIS_ID = os.getenv('TINKOFF_IIS_ID')
 #TINKOFF_IIS_ID = 'your_tinkoffiis_id'
 '''Iis broker account id'''
@@ -27,18 +110,83 @@ EMAIL_SERVER = os.getenv('EMAIL_SERVER')
 #EMAIL_SERVER = 'your_email_server'
 '''Mail server'''
 
+ENABLE_MAIL_MODULE = True
+'''Receive alerts by email'''
+
+MAIL_INGEST_MODE = 'idle'
+'''"idle" for IMAP IDLE push, "poll" for periodic checks'''
+
+MAIL_POLL_INTERVAL = 1
+'''Seconds between mailbox checks, one check serves all strategies'''
+
+MAIL_IDLE_TIMEOUT = 300
+'''Seconds before IDLE is renewed, must stay below 29 minutes (RFC 2177)'''
+
+MAIL_RECONNECT_DELAY = 5
+'''Seconds to wait before reconnecting after mail connection failure'''
+
 TIME_ZONE_UTC = 'UTC'
 TIME_ZONE_LOCAL = 'Europe/Moscow'
 '''Time zones'''
 
+ENABLE_WEBHOOK_MODULE = False
+WEBHOOK_ADDRESS = os.getenv('WEBHOOK_ADDRESS', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+#WEBHOOK_SECRET = 'shared secret from alert webhook url'
+'''
+Receive alerts by TradingView webhook, TradingView posts only to ports
+80 and 443, so other ports need a reverse proxy in front of the bot
+'''
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) or None
+METRICS_ADDRESS = os.getenv('METRICS_ADDRESS', '127.0.0.1')
+'''Prometheus /metrics and /traces endpoint, disabled without port'''
+
+METRICS_FILE = os.getenv('METRICS_FILE')
+TRACES_FILE = os.getenv('TRACES_FILE')
+METRICS_FILE_INTERVAL = 10
+'''Prometheus text file rewritten and json lines traces appended every interval seconds'''
+
+INSTRUMENT_CACHE_PATH = os.getenv('INSTRUMENT_CACHE_PATH', 'instrument_cache.json')
+INSTRUMENT_CACHE_TTL = 24 * 60 * 60
+'''Instrument metadata file and seconds before entry is refreshed'''
+
+OPERATIONS_DB_PATH = os.getenv('OPERATIONS_DB_PATH', 'operations.sqlite3')
+OPERATIONS_HISTORY_START = '2015-12-31T00:00:00+00:00'
+OPERATIONS_SYNC_WINDOW_DAYS = 30
+OPERATIONS_SYNC_OVERLAP_DAYS = 1
+'''Operations history database, first sync start, request window and refetched tail'''
+
 STRATEGIES = {
   'RIG_TEST': 'RIG',
   'SPCE_TEST': 'SPCE'
 }
 '''Dict of strategies and their tickers'''
 
+STRATEGY_ACCOUNTS = {}
+#STRATEGY_ACCOUNTS = {'RIG_TEST': 'TinkoffIis'}
+'''
+Broker account of strategy, account type ("Tinkoff", "TinkoffIis")
+or brokerAccountId, strategies not listed trade the default account
+'''
+
+STRATEGIES_FILE = os.getenv('STRATEGIES_FILE')
+STRATEGIES_FILE_INTERVAL = 5
+'''
+Json file replacing STRATEGIES and STRATEGY_ACCOUNTS: {"name": "ticker"}
+or {"name": {"ticker": "...", "account": "..."}}, checked for changes every
+interval seconds, telegram /strategy changes are written back to it
+'''
+
 ENABLED_DATABASE_LOGS = False
-'''Database connection'''
+JOURNAL_DB_PATH = os.getenv('JOURNAL_DB_PATH', 'journal.sqlite3')
+JOURNAL_QUEUE_SIZE = 10000
+JOURNAL_BATCH_SIZE = 1000
+'''
+Journal of alerts, order requests and placed orders, entries
+waiting before new ones are dropped and max entries per commit
+'''
 
 TELEGRAM_API_TOKEN = os.getenv('TELEGRAM_API_TOKEN')
 #TELEGRAM_API_TOKEN = 'bot token for telegram from @BotFather'
@@ -46,3 +194,12 @@ TELEGRAM_ADMIN_ID = os.getenv('TELEGRAM_ADMIN_ID')
 #TELEGRAM_ADMIN_ID = 'your personal account id in telegram'
 ENABLE_TELEGRAM_MODULE = True
 '''Telegram connection'''
+
+TELEGRAM_QUEUE_SIZE = 1000
+TELEGRAM_BATCH_INTERVAL = 1
+TELEGRAM_MESSAGES_PER_MINUTE = 20
+TELEGRAM_DELAYED_AFTER = 10
+'''
+Notifications waiting before new ones are dropped, seconds to coalesce
+a burst into one message, send rate and seconds after which message counts as delayed
+'''